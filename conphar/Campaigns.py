@@ -0,0 +1,756 @@
+__version__ = "0.1.0"
+__author__  = "https://github.com/AngelRuizMoreno"
+
+import os, json, asyncio, tempfile, sqlite3, time, subprocess, hashlib, shutil, glob
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from ._pharmit import _pharma, _pharma_async
+from ._readers import _parse_pharmacophore_data, _split_json_documents, _iter_molecules, _load_json_chunk, _file_signature
+from .Pharmacophores import _molecule_blocks, _perceive_molecule, parse_json_pharmacophore, compute_concensus_pharmacophore, save_pharmacophore_to_json
+
+__all__=['read_pharmacophore_manifest','run_pharmacophore_batch','run_pharmacophore_batch_async','get_library_pharmacophores','run_pharmacophore_campaign','read_campaign_status','watch_pharmacophore_directory']
+
+
+def read_pharmacophore_manifest(jobs):
+    """Read a list of receptor-ligand pharmacophore jobs.
+
+    This function normalizes the different ways of describing a batch of PHARMIT jobs into a list of (receptor, ligand, out) triples. A manifest can be a CSV file or a DataFrame with the columns 'receptor', 'ligand' and 'out', or any iterable of triples. An out of None keeps the output of the job in memory instead of writing a file.
+
+    Args:
+        jobs (str, pd.DataFrame or list): The CSV file name, DataFrame or list of (receptor, ligand, out) triples.
+
+    Returns:
+        list: A list of (receptor, ligand, out) tuples.
+
+    Example:
+        >>> read_pharmacophore_manifest([('5R7Y_A.pdb', '5R7Y_lig.sdf', 'pharmacophores/5R7Y')])
+        [('5R7Y_A.pdb', '5R7Y_lig.sdf', 'pharmacophores/5R7Y')]
+    """
+    if isinstance(jobs, str):
+        jobs = pd.read_csv(jobs)
+
+    if isinstance(jobs, pd.DataFrame):
+        jobs = jobs[['receptor','ligand','out']].itertuples(index=False, name=None)
+
+    return [tuple(job) for job in jobs]
+
+
+def __job_result(receptor:str,ligand:str,out:str,out_format:str,returncode:int,output:bytes):
+
+    table = None
+    if out is None:
+        if returncode == 0 and output:
+            status = 'done'
+            table, lig, rec = _parse_pharmacophore_data(json.loads(output))
+        else:
+            status = 'failed'
+    else:
+        out_file = f'{out}.{out_format}'
+        # an empty output file is a failed run, as an empty piped output is
+        if returncode == 0 and os.path.exists(out_file) and os.path.getsize(out_file) > 0:
+            status = 'done'
+            if out_format == 'json':
+                table, lig, rec = parse_json_pharmacophore(out_file)
+        else:
+            status = 'failed'
+
+    return {'receptor':receptor, 'ligand':ligand, 'out':out, 'status':status, 'returncode':returncode, 'table':table}
+
+
+def __pharma_retry(retries:int,**options):
+    """Run _pharma, and run it again up to `retries` times when it times out. Raises subprocess.TimeoutExpired if the last attempt timed out too."""
+    for attempt in range(retries):
+        try:
+            return _pharma(**options)
+        except subprocess.TimeoutExpired:
+            pass
+    return _pharma(**options)
+
+
+def __run_job(receptor:str,ligand:str,out:str,out_format:str,retries:int,options:dict):
+
+    out_file = None if out is None else f'{out}.{out_format}'
+    try:
+        returncode, output = __pharma_retry(retries, ligand=ligand, out_file=out_file, receptor=receptor, **options)
+    except subprocess.TimeoutExpired:
+        return {'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'timeout', 'returncode':None, 'table':None}
+    return __job_result(receptor, ligand, out, out_format, returncode, output)
+
+
+def __append_molecules(ligand:str,handle):
+    """Append the molecules of an SDF or MOL2 file to an open file and return how many were appended."""
+    sdf = os.path.splitext(ligand)[1].lower() == '.sdf'
+    count = 0
+    last = ''
+    with open(ligand, 'r') as file:
+        for line in file:
+            if sdf and line.startswith('$$$$') or not sdf and line.startswith('@<TRIPOS>MOLECULE'):
+                count = count + 1
+            handle.write(line)
+            last = line
+
+    if last and not last.endswith('\n'):
+        handle.write('\n')
+    # an SDF without the final $$$$ would merge its last molecule with the next file
+    if sdf and last.strip() and not last.startswith('$$$$'):
+        handle.write('$$$$\n')
+        count = count + 1
+
+    return count
+
+
+def __run_receptor_group(receptor:str,group:list,out_format:str,retries:int,options:dict):
+
+    with tempfile.TemporaryDirectory() as folder:
+        combined = os.path.join(folder, f'ligands{os.path.splitext(group[0][0])[1]}')
+        with open(combined, 'w') as handle:
+            counts = [__append_molecules(ligand, handle) for ligand, out in group]
+        try:
+            returncode, output = __pharma_retry(retries, ligand=combined, receptor=receptor, **options)
+        except subprocess.TimeoutExpired:
+            return [{'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'timeout', 'returncode':None, 'table':None} for ligand, out in group]
+
+    documents = _split_json_documents(output) if returncode == 0 and output else []
+
+    # a molecule that PHARMIT could not read shifts the documents of all the others, so the ligands are run one by one instead
+    if len(documents) != sum(counts):
+        results = []
+        for ligand, out in group:
+            try:
+                results.append(__run_job(receptor, ligand, out, out_format, retries, options))
+            except Exception as error:
+                results.append({'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'error', 'returncode':None, 'table':None, 'error':error})
+        return results
+
+    results = []
+    start = 0
+    for (ligand, out), count in zip(group, counts):
+        result = {'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'failed', 'returncode':returncode, 'table':None}
+        if count > 0:
+            try:
+                # PHARMIT writes "points": null for a molecule without features
+                data = {'points':[point for document in documents[start:start+count] for point in document.get('points') or []]}
+                if out is not None:
+                    with open(f'{out}.{out_format}', 'w') as file:
+                        json.dump(data, file)
+                result['table'], lig, rec = _parse_pharmacophore_data(data)
+                result['status'] = 'done'
+            except Exception as error:
+                result['status'], result['error'] = 'error', error
+        start = start + count
+        results.append(result)
+
+    return results
+
+
+def __receptor_groups(jobs:list,group_size:int):
+    """Group jobs by receptor and ligand format, in chunks of at most group_size ligands."""
+    groups = {}
+    for receptor, ligand, out in jobs:
+        groups.setdefault((receptor, os.path.splitext(ligand)[1].lower()), []).append((ligand, out))
+
+    for (receptor, _), group in groups.items():
+        for start in range(0, len(group), group_size):
+            yield receptor, group[start:start+group_size]
+
+
+async def __run_job_async(receptor:str,ligand:str,out:str,out_format:str,retries:int,options:dict,semaphore:asyncio.Semaphore):
+
+    out_file = None if out is None else f'{out}.{out_format}'
+    try:
+        for attempt in range(retries+1):
+            try:
+                returncode, output = await _pharma_async(ligand=ligand, out_file=out_file, receptor=receptor, semaphore=semaphore, **options)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+        else:
+            return {'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'timeout', 'returncode':None, 'table':None}
+        return __job_result(receptor, ligand, out, out_format, returncode, output)
+    except Exception as error:
+        return {'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'error', 'returncode':None, 'table':None, 'error':error}
+
+
+def __coordinates(x:str,y:str,z:str):
+    return f"{float(x):.3f} {float(y):.3f} {float(z):.3f}"
+
+
+def __structure_fingerprint(file_name:str):
+    """Hash the atoms, coordinates and bonds of a PDB, SDF or MOL2 file, ignoring titles, headers, serial numbers, chain identifiers, B-factors, SD properties and number formatting."""
+    extension = os.path.splitext(file_name)[1].lower()
+    digest = hashlib.sha256(extension.encode())
+
+    with open(file_name, 'r') as file:
+        if extension in ('.pdb', '.ent'):
+            for line in file:
+                if line.startswith(('ATOM  ', 'HETATM')):
+                    # atom name, altloc and residue name / x, y, z / element and charge
+                    digest.update(f"{line[12:20]}|{__coordinates(line[30:38], line[38:46], line[46:54])}|{line[76:80].strip()}\n".encode())
+
+        elif extension == '.sdf':
+            header = 0
+            for line in file:
+                # the title, program and comment lines of each molecule are skipped, and so are its SD properties
+                if header < 3:
+                    header = header + 1
+                elif line.startswith('$$$$'):
+                    header = 0
+                    digest.update(b'$$$$\n')
+                elif header == 3:
+                    fields = line.split()
+                    if line.startswith('M  END'):
+                        header = 4
+                    elif len(fields) >= 4 and len(line) >= 34 and not line.startswith('M  ') and 'V2000' not in line and 'V3000' not in line:
+                        try:
+                            digest.update(f"{__coordinates(line[0:10], line[10:20], line[20:30])}|{line[30:].rstrip()}\n".encode())
+                        except ValueError:
+                            digest.update(line.rstrip().encode()+b'\n')
+                    else:
+                        digest.update(line.rstrip().encode()+b'\n')
+
+        else:
+            section = None
+            for line in file:
+                if line.startswith('@<TRIPOS>'):
+                    section = line.strip()
+                    digest.update(line.strip().encode()+b'\n')
+                elif section == '@<TRIPOS>ATOM' and len(line.split()) >= 6:
+                    fields = line.split()
+                    digest.update(f"{fields[1]}|{__coordinates(*fields[2:5])}|{fields[5]}\n".encode())
+                elif section == '@<TRIPOS>BOND':
+                    digest.update(' '.join(line.split()).encode()+b'\n')
+
+    return digest.hexdigest()
+
+
+def __deduplicate_jobs(jobs:list):
+    """Find the jobs with the same receptor and ligand structures.
+
+    Returns:
+        tuple: The list of unique jobs, and a dictionary from each unique job to the list of its duplicates. A job with an output file is preferred as the unique one, so that its file can be copied to the duplicates.
+    """
+    fingerprints = {}
+    groups = {}
+    for receptor, ligand, out in jobs:
+        for file_name in (receptor, ligand):
+            if file_name not in fingerprints:
+                try:
+                    fingerprints[file_name] = __structure_fingerprint(file_name)
+                except (OSError, UnicodeDecodeError):
+                    # unreadable inputs are never merged, PHARMIT reports the error
+                    fingerprints[file_name] = file_name
+        groups.setdefault((fingerprints[receptor], fingerprints[ligand]), []).append((receptor, ligand, out))
+
+    unique, duplicates = [], {}
+    for group in groups.values():
+        group = sorted(group, key=lambda job: job[2] is None)
+        unique.append(group[0])
+        if len(group) > 1:
+            duplicates[group[0]] = group[1:]
+
+    return unique, duplicates
+
+
+def __fan_out(result:dict,job:tuple,out_format:str):
+    """Build the result of a duplicate job from the result of its unique job, copying the output file."""
+    receptor, ligand, out = job
+    duplicate = dict(result, receptor=receptor, ligand=ligand, out=out, duplicate_of=(result['receptor'], result['ligand'], result['out']))
+    if result['table'] is not None:
+        duplicate['table'] = result['table'].copy()
+
+    if out is not None and result['status'] == 'done':
+        try:
+            shutil.copyfile(f"{result['out']}.{out_format}", f'{out}.{out_format}')
+        except Exception as error:
+            duplicate['status'], duplicate['error'] = 'error', error
+
+    return duplicate
+
+
+def run_pharmacophore_batch(jobs, out_format:str='json', cmd:str='pharma', n_workers:int=None, cache_dir:str=None, cache_size:int=2**30, timeout:float=None, memory_limit:int=None, cpu_limit:int=None, retries:int=0, group_by_receptor:bool=False, group_size:int=64, deduplicate:bool=False, verbose:bool=True):
+    """Generate pharmacophore models for many ligand-receptor complexes in parallel.
+
+    This function runs one PHARMIT process per (receptor, ligand, out) job on a bounded pool of workers, so that several complexes are processed at the same time. Results are yielded as soon as each job finishes, in completion order rather than in the order of the manifest.
+
+    With group_by_receptor, the ligands of the jobs sharing a receptor are concatenated into a single multi-molecule input and PHARMIT runs once per group, so that the receptor is parsed once. The output of the group is split back into one pharmacophore per ligand (the points of all the molecules of a ligand file are merged). This mode only produces JSON outputs. When the output of a group does not have one document per molecule (e.g. PHARMIT could not read one of them), its ligands are run one by one.
+
+    With deduplicate, the receptor and ligand files are first fingerprinted by their atoms, coordinates (to 0.001 Å) and bonds, ignoring headers, titles, serial numbers, chain identifiers and SD properties. PHARMIT runs once for each unique receptor-ligand pair and its result is given to all the duplicate jobs, whose output files are copies.
+
+    Args:
+        jobs (str, pd.DataFrame or list): The jobs to run, in any form accepted by read_pharmacophore_manifest.
+        out_format (str, optional): The format of the output files. Defaults to 'json'.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        n_workers (int, optional): The maximum number of PHARMIT processes running at the same time. Defaults to the number of CPUs of the machine.
+        cache_dir (str, optional): The folder of the PHARMIT output cache, see get_ligand_receptor_pharmacophore. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of each PHARMIT process in seconds. A process running longer is killed and its jobs are reported with the status 'timeout'. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of each PHARMIT process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of each PHARMIT process in seconds. Defaults to None (no limit).
+        retries (int, optional): The number of times a timed out PHARMIT process is run again. Defaults to 0.
+        group_by_receptor (bool, optional): A boolean indicating whether to run the ligands of each receptor together in one PHARMIT process. Defaults to False.
+        group_size (int, optional): The maximum number of ligands in one group when group_by_receptor is True. Defaults to 64.
+        deduplicate (bool, optional): A boolean indicating whether to run PHARMIT only once for jobs with identical receptor and ligand structures. Defaults to False.
+        verbose (bool, optional): A boolean indicating whether to print the status of each job when it finishes. Defaults to True.
+
+    Yields:
+        dict: A dictionary for each finished job with the keys 'receptor', 'ligand', 'out', 'status' ('done', 'failed' if PHARMIT exited with an error or wrote no output, 'timeout' or 'error' if its output could not be read), 'returncode' and 'table' (the parsed pharmacophore DataFrame, empty for a ligand without features, or None). The results of duplicate jobs also have the key 'duplicate_of' with the (receptor, ligand, out) job that was run for them.
+
+    Example:
+        >>> jobs = [('receptor/5R7Y_A.pdb', 'ligand/5R7Y_lig.sdf', 'pharmacophores/5R7Y'),
+        ...         ('receptor/5R7Z_A.pdb', 'ligand/5R7Z_lig.sdf', 'pharmacophores/5R7Z')]
+        >>> for result in run_pharmacophore_batch(jobs):
+        ...     print(result['out'], result['status'])
+        pharmacophores/5R7Z done
+        pharmacophores/5R7Y done
+
+    Raises:
+        ValueError: If group_by_receptor is True and out_format is not 'json'.
+    """
+    if group_by_receptor and out_format != 'json':
+        raise ValueError(f"group_by_receptor only produces JSON outputs, got out_format={out_format!r}")
+
+    jobs = read_pharmacophore_manifest(jobs)
+    options = dict(cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit)
+    total = len(jobs)
+
+    duplicates = {}
+    if deduplicate:
+        jobs, duplicates = __deduplicate_jobs(jobs)
+        if verbose:
+            print(f"{total-len(jobs)} duplicate jobs, {len(jobs)} unique jobs to run")
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        if group_by_receptor:
+            futures = {executor.submit(__run_receptor_group, receptor, group, out_format, retries, options):[(receptor, ligand, out) for ligand, out in group] for receptor, group in __receptor_groups(jobs, group_size)}
+        else:
+            futures = {executor.submit(__run_job, receptor, ligand, out, out_format, retries, options):[(receptor, ligand, out)] for receptor, ligand, out in jobs}
+
+        try:
+            n = 0
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                    if not group_by_receptor:
+                        results = [results]
+                except Exception as error:
+                    results = [{'receptor':receptor, 'ligand':ligand, 'out':out, 'status':'error', 'returncode':None, 'table':None, 'error':error} for receptor, ligand, out in futures[future]]
+
+                for result in results:
+                    key = (result['receptor'], result['ligand'], result['out'])
+                    for result in [result]+[__fan_out(result, job, out_format) for job in duplicates.get(key, [])]:
+                        n = n + 1
+                        if verbose:
+                            print(f"[{n}/{total}] {result['out']}: {result['status']}")
+
+                        yield result
+        finally:
+            # stopping early must not run the jobs that are still queued
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def __open_campaign(database:str):
+    connection = sqlite3.connect(database)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                              receptor TEXT NOT NULL,
+                              ligand TEXT NOT NULL,
+                              out TEXT NOT NULL,
+                              status TEXT NOT NULL DEFAULT 'pending',
+                              returncode INTEGER,
+                              attempts INTEGER NOT NULL DEFAULT 0,
+                              updated REAL,
+                              PRIMARY KEY (receptor, ligand, out))""")
+    return connection
+
+
+def run_pharmacophore_campaign(jobs, database:str='campaign.db', retry_failed:bool=False, out_format:str='json', cmd:str='pharma', n_workers:int=None, cache_dir:str=None, cache_size:int=2**30, timeout:float=None, memory_limit:int=None, cpu_limit:int=None, retries:int=0, group_by_receptor:bool=False, group_size:int=64, deduplicate:bool=False, verbose:bool=True):
+    """Run a resumable campaign of ligand-receptor pharmacophore jobs.
+
+    This function records every job of the manifest in a SQLite database and runs the unfinished ones with run_pharmacophore_batch. Each job is marked as 'done' or 'failed' as soon as it finishes, so if the campaign is interrupted (crash, preemption or Ctrl+C), calling the function again with the same database only runs the jobs that did not finish. New jobs added to the manifest are added to the database as 'pending'.
+
+    Args:
+        jobs (str, pd.DataFrame or list): The jobs of the campaign, in any form accepted by read_pharmacophore_manifest. Every job needs an output file name.
+        database (str, optional): The file name of the SQLite database keeping the state of the campaign. Defaults to 'campaign.db'.
+        retry_failed (bool, optional): A boolean indicating whether to run again the jobs that failed or timed out in previous runs. Defaults to False.
+        out_format (str, optional): The format of the output files. Defaults to 'json'.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        n_workers (int, optional): The maximum number of PHARMIT processes running at the same time. Defaults to the number of CPUs of the machine.
+        cache_dir (str, optional): The folder of the PHARMIT output cache, see get_ligand_receptor_pharmacophore. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of each PHARMIT process in seconds. A process running longer is killed and its jobs are reported with the status 'timeout'. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of each PHARMIT process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of each PHARMIT process in seconds. Defaults to None (no limit).
+        retries (int, optional): The number of times a timed out PHARMIT process is run again. Defaults to 0.
+        group_by_receptor (bool, optional): A boolean indicating whether to run the ligands of each receptor together, see run_pharmacophore_batch. Defaults to False.
+        group_size (int, optional): The maximum number of ligands in one group. Defaults to 64.
+        deduplicate (bool, optional): A boolean indicating whether to run PHARMIT only once for jobs with identical receptor and ligand structures, see run_pharmacophore_batch. Defaults to False.
+        verbose (bool, optional): A boolean indicating whether to print the status of each job when it finishes. Defaults to True.
+
+    Yields:
+        dict: A dictionary for each job run in this call, as yielded by run_pharmacophore_batch.
+
+    Example:
+        >>> for result in run_pharmacophore_campaign('manifest.csv', database='campaign.db'):
+        ...     pass
+        >>> read_campaign_status('campaign.db').status.value_counts()
+        done       4980
+        failed       20
+
+    Raises:
+        ValueError: If a job has no output file name, or if group_by_receptor is True and out_format is not 'json'.
+    """
+    if group_by_receptor and out_format != 'json':
+        raise ValueError(f"group_by_receptor only produces JSON outputs, got out_format={out_format!r}")
+
+    jobs = read_pharmacophore_manifest(jobs)
+    if any(out is None for receptor, ligand, out in jobs):
+        raise ValueError("every job of a campaign needs an output file name")
+
+    connection = __open_campaign(database)
+    try:
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO jobs (receptor, ligand, out) VALUES (?, ?, ?)", [(str(receptor), str(ligand), str(out)) for receptor, ligand, out in jobs])
+
+        # 'running' jobs were interrupted before they could be recorded
+        unfinished = ('pending', 'running', 'failed', 'timeout', 'error') if retry_failed else ('pending', 'running')
+        todo = {(str(receptor), str(ligand), str(out)) for receptor, ligand, out in jobs}
+        pending = [job for job in connection.execute(f"SELECT receptor, ligand, out FROM jobs WHERE status IN ({','.join('?'*len(unfinished))})", unfinished) if job in todo]
+
+        if verbose:
+            print(f"{len(todo)-len(pending)} of {len(todo)} jobs already finished, {len(pending)} to run")
+
+        with connection:
+            connection.executemany("UPDATE jobs SET status='running', attempts=attempts+1, updated=? WHERE receptor=? AND ligand=? AND out=?", [(time.time(),)+job for job in pending])
+
+        for result in run_pharmacophore_batch(pending, out_format=out_format, cmd=cmd, n_workers=n_workers, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, retries=retries, group_by_receptor=group_by_receptor, group_size=group_size, deduplicate=deduplicate, verbose=verbose):
+            with connection:
+                connection.execute("UPDATE jobs SET status=?, returncode=?, updated=? WHERE receptor=? AND ligand=? AND out=?",
+                                   (result['status'], result['returncode'], time.time(), result['receptor'], result['ligand'], result['out']))
+            yield result
+    finally:
+        connection.close()
+
+
+def read_campaign_status(database:str='campaign.db'):
+    """Read the state of the jobs of a pharmacophore campaign.
+
+    Args:
+        database (str, optional): The file name of the SQLite database of the campaign. Defaults to 'campaign.db'.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the columns 'receptor', 'ligand', 'out', 'status', 'returncode', 'attempts' and 'updated' for each job.
+
+    Example:
+        >>> read_campaign_status('campaign.db').status.value_counts()
+        done       4980
+        failed       20
+    """
+    connection = __open_campaign(database)
+    try:
+        return pd.read_sql_query("SELECT * FROM jobs", connection)
+    finally:
+        connection.close()
+
+
+def __iter_library_chunks(library:str,chunk_size:int):
+    """Read an SDF or MOL2 library lazily and yield the names and the text of chunks of chunk_size molecules."""
+    names, texts = [], []
+    for name, text in _iter_molecules(library):
+        names.append(name)
+        texts.append(text)
+        if len(names) == chunk_size:
+            yield names, ''.join(texts)
+            names, texts = [], []
+
+    if names:
+        yield names, ''.join(texts)
+
+
+def __run_library_chunk(start:int,names:list,text:str,extension:str,retries:int,options:dict):
+
+    with tempfile.TemporaryDirectory() as folder:
+        chunk = os.path.join(folder, f'chunk{extension}')
+        with open(chunk, 'w') as file:
+            file.write(text)
+        try:
+            returncode, output = __pharma_retry(retries, ligand=chunk, **options)
+        except subprocess.TimeoutExpired:
+            return [({'molecule':start+i, 'name':name, 'status':'timeout', 'returncode':None, 'table':None}, []) for i, name in enumerate(names)]
+
+    documents = _split_json_documents(output) if returncode == 0 and output else []
+
+    results = []
+    for i, name in enumerate(names):
+        result, points = {'molecule':start+i, 'name':name, 'status':'failed', 'returncode':returncode, 'table':None}, []
+        # molecules are matched to the outputs by position, which only holds if PHARMIT read all of them
+        if len(documents) == len(names):
+            # PHARMIT writes "points": null for a molecule without features
+            points = documents[i].get('points') or []
+            try:
+                result['table'], lig, rec = _parse_pharmacophore_data({'points':points})
+                result['status'] = 'done'
+            except Exception as error:
+                result['status'], result['error'], points = 'error', error, []
+        results.append((result, points))
+
+    return results
+
+
+def __perceive_library_chunk(start:int,names:list,text:str,extension:str):
+    """Perceive the pharmacophores of the molecules of a library chunk in-process, see get_molecule_pharmacophore with engine='numpy'."""
+    blocks, reader = _molecule_blocks(text, extension)
+
+    results = []
+    for i, name in enumerate(names):
+        result, points = {'molecule':start+i, 'name':name, 'status':'failed', 'returncode':None, 'table':None}, []
+        if len(blocks) == len(names):
+            try:
+                points = _perceive_molecule(*reader(blocks[i]))
+                result['table'], lig, rec = _parse_pharmacophore_data({'points':points})
+                result['status'] = 'done'
+            except Exception as error:
+                result['status'], result['error'], points = 'error', error, []
+        results.append((result, points))
+
+    return results
+
+
+def get_library_pharmacophores(library:str, out:str=None, chunk_size:int=1000, n_workers:int=None, cmd:str='pharma', cache_dir:str=None, cache_size:int=2**30, timeout:float=None, memory_limit:int=None, cpu_limit:int=None, retries:int=0, engine:str='pharmit', verbose:bool=True):
+    """Generate the pharmacophore of every molecule of a large SDF or MOL2 library.
+
+    This function reads the library lazily, splits it into chunks of chunk_size molecules and runs one PHARMIT process per chunk on a bounded pool of workers. Only a few chunks are held in memory at a time, so libraries of any size can be processed. The pharmacophore of each molecule is yielded as soon as its chunk finishes, in completion order.
+
+    With engine='numpy', the chunks are perceived in-process by the NumPy engine of get_molecule_pharmacophore on a pool of n_workers Python processes, without running PHARMIT; the PHARMIT options are then ignored.
+
+    Args:
+        library (str): The file name of the library in SDF or MOL2 format.
+        out (str, optional): The base name of a consolidated JSON file where the points of all molecules are written, tagged with the 'molecule' index and the 'ligand' name. The file can be read with parse_json_pharmacophore. Defaults to None.
+        chunk_size (int, optional): The number of molecules sent to each PHARMIT process. Defaults to 1000.
+        n_workers (int, optional): The maximum number of PHARMIT processes running at the same time. Defaults to the number of CPUs of the machine.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        cache_dir (str, optional): The folder of the PHARMIT output cache, see get_ligand_receptor_pharmacophore. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of each PHARMIT process in seconds. A process running longer is killed and its jobs are reported with the status 'timeout'. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of each PHARMIT process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of each PHARMIT process in seconds. Defaults to None (no limit).
+        retries (int, optional): The number of times a timed out PHARMIT process is run again. Defaults to 0.
+        engine (str, optional): 'pharmit' to run PHARMIT, or 'numpy' to perceive the features in-process. Defaults to 'pharmit'.
+        verbose (bool, optional): A boolean indicating whether to print the progress of each chunk. Defaults to True.
+
+    Yields:
+        dict: A dictionary for each molecule with the keys 'molecule' (its position in the library), 'name', 'status' ('done', 'failed' if PHARMIT exited with an error or wrote no output for it, 'timeout' or 'error' if its output could not be read), 'returncode' and 'table' (the parsed pharmacophore DataFrame, empty for a molecule without features, or None).
+
+    Example:
+        >>> for result in get_library_pharmacophores('library.sdf', out='library_pharmacophores', chunk_size=500):
+        ...     print(result['name'], len(result['table']))
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if engine not in ('pharmit', 'numpy'):
+        raise ValueError(f"Unknown engine {engine}, use 'pharmit' or 'numpy'")
+
+    extension = os.path.splitext(library)[1].lower()
+    options = dict(cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit)
+    store = None if out is None else open(f'{out}.json', 'w')
+    first = True
+    n = 0
+
+    def finished(futures):
+        nonlocal first, n
+        for future in futures:
+            results = future.result()
+            for result, points in results:
+                if store is not None:
+                    for point in points:
+                        store.write(('' if first else ',')+json.dumps(dict(point, molecule=result['molecule'], ligand=result['name'])))
+                        first = False
+                yield result
+            n = n + len(results)
+            if verbose:
+                print(f"{n} molecules processed")
+
+    try:
+        if store is not None:
+            store.write('{"points":[')
+
+        # the PHARMIT processes only need threads to wait on them, the in-process engine needs processes
+        with (ThreadPoolExecutor if engine == 'pharmit' else ProcessPoolExecutor)(max_workers=n_workers) as executor:
+            pending = set()
+            start = 0
+            for names, text in __iter_library_chunks(library, chunk_size):
+                if engine == 'pharmit':
+                    pending.add(executor.submit(__run_library_chunk, start, names, text, extension, retries, options))
+                else:
+                    pending.add(executor.submit(__perceive_library_chunk, start, names, text, extension))
+                start = start + len(names)
+                if len(pending) >= 2*n_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from finished(done)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+    finally:
+        if store is not None:
+            store.write(']}')
+            store.close()
+
+
+async def run_pharmacophore_batch_async(jobs, out_format:str='json', cmd:str='pharma', concurrency:int=None, cache_dir:str=None, cache_size:int=2**30, timeout:float=None, memory_limit:int=None, cpu_limit:int=None, retries:int=0, deduplicate:bool=False, verbose:bool=True):
+    """Generate pharmacophore models for many ligand-receptor complexes from an asyncio event loop.
+
+    This asynchronous generator is the asyncio version of run_pharmacophore_batch. All jobs are scheduled at once as asyncio subprocesses and a semaphore keeps at most `concurrency` PHARMIT processes running. If the generator is closed or the consuming task is cancelled, the pending jobs are cancelled and their PHARMIT processes are killed.
+
+    Args:
+        jobs (str, pd.DataFrame or list): The jobs to run, in any form accepted by read_pharmacophore_manifest.
+        out_format (str, optional): The format of the output files. Defaults to 'json'.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        concurrency (int, optional): The maximum number of PHARMIT processes running at the same time. Defaults to the number of CPUs of the machine.
+        cache_dir (str, optional): The folder of the PHARMIT output cache, see get_ligand_receptor_pharmacophore. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of each PHARMIT process in seconds. A process running longer is killed and its jobs are reported with the status 'timeout'. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of each PHARMIT process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of each PHARMIT process in seconds. Defaults to None (no limit).
+        retries (int, optional): The number of times a timed out PHARMIT process is run again. Defaults to 0.
+        deduplicate (bool, optional): A boolean indicating whether to run PHARMIT only once for jobs with identical receptor and ligand structures, see run_pharmacophore_batch. Defaults to False.
+        verbose (bool, optional): A boolean indicating whether to print the status of each job when it finishes. Defaults to True.
+
+    Yields:
+        dict: A dictionary for each finished job, as yielded by run_pharmacophore_batch.
+
+    Example:
+        >>> async for result in run_pharmacophore_batch_async('manifest.csv', concurrency=16):
+        ...     print(result['out'], result['status'])
+    """
+    jobs = read_pharmacophore_manifest(jobs)
+    options = dict(cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit)
+    semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+    total = len(jobs)
+
+    duplicates = {}
+    if deduplicate:
+        jobs, duplicates = __deduplicate_jobs(jobs)
+
+    tasks = [asyncio.ensure_future(__run_job_async(receptor, ligand, out, out_format, retries, options, semaphore)) for receptor, ligand, out in jobs]
+    try:
+        n = 0
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            key = (result['receptor'], result['ligand'], result['out'])
+            for result in [result]+[__fan_out(result, job, out_format) for job in duplicates.get(key, [])]:
+                n = n + 1
+                if verbose:
+                    print(f"[{n}/{total}] {result['out']}: {result['status']}")
+
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def __publish_concensus(concensus:pd.DataFrame,out_file:str):
+    """Write a consensus snapshot to a JSON file atomically, so that readers never see a partial file."""
+    folder = os.path.dirname(os.path.abspath(out_file))
+    with tempfile.NamedTemporaryFile(dir=folder, suffix='.json', delete=False) as temporary:
+        pass
+    try:
+        save_pharmacophore_to_json(concensus, out_file=temporary.name)
+        os.replace(temporary.name, out_file)
+    except BaseException:
+        os.remove(temporary.name)
+        raise
+
+
+def watch_pharmacophore_directory(folder:str, pattern:str='*.json', every_n:int=None, every_seconds:float=None, poll_interval:float=1.0, duration:float=None, out_file:str=None, h_dist:float=0.17, verbose:bool=True):
+    """Watch a folder of PHARMIT JSON pharmacophores and refresh the consensus pharmacophore as new files arrive.
+
+    This function polls the folder every poll_interval seconds and ingests only the files that were added, changed (new modification time or size) or removed since the last poll, updating the pharmacophore table in memory. A new consensus snapshot is computed with compute_concensus_pharmacophore after every_n arrivals or every_seconds seconds, whichever comes first, and only the descriptors (feature types) whose points changed are clustered again; the clusters of the other descriptors are reused. Files that cannot be parsed yet (e.g. still being written) are retried when they change.
+
+    Args:
+        folder (str): The folder receiving the JSON files.
+        pattern (str, optional): The glob pattern of the files to watch, relative to the folder. Defaults to '*.json'.
+        every_n (int, optional): The number of added, changed or removed files that triggers a snapshot. Defaults to None (a snapshot at every poll with changes, unless every_seconds is given).
+        every_seconds (float, optional): The time in seconds after which pending changes trigger a snapshot. Defaults to None.
+        poll_interval (float, optional): The time in seconds between two scans of the folder. Defaults to 1.0.
+        duration (float, optional): The time in seconds after which the watch stops, publishing the pending changes. Defaults to None (watch until the caller stops iterating).
+        out_file (str, optional): The JSON file where every snapshot is published (replaced atomically), in the format of save_pharmacophore_to_json. Defaults to None.
+        h_dist (float, optional): The distance threshold of the hierarchical clustering, see compute_concensus_pharmacophore. Defaults to 0.17.
+        verbose (bool, optional): A boolean indicating whether to print a line for every snapshot. Defaults to True.
+
+    Yields:
+        tuple: A tuple of three elements for every snapshot:
+            - concensus (pd.DataFrame): The consensus pharmacophore, see compute_concensus_pharmacophore.
+            - links (dict): The distance and linkage matrices of each descriptor, see compute_concensus_pharmacophore.
+            - table (pd.DataFrame): The pharmacophore table of all the watched files, with the 'ligand' column.
+
+    Example:
+        >>> for concensus, links, table in watch_pharmacophore_directory('pharmacophores/', every_n=100, every_seconds=600, out_file='concensus.json'):
+        ...     print(len(table['ligand'].unique()), len(concensus))
+    """
+    signatures, tables, descriptors = {}, {}, {}
+    changed, pending = set(), 0
+    started = last = time.monotonic()
+
+    while True:
+        json_files = {os.path.abspath(json_file) for json_file in glob.glob(os.path.join(folder, pattern), recursive=True)}
+        for json_file in set(signatures)-json_files:
+            signatures.pop(json_file)
+            removed = tables.pop(json_file, None)
+            if removed is not None:
+                changed.update(removed['name'].unique())
+            pending = pending + 1
+
+        arrivals = []
+        for json_file in sorted(json_files):
+            try:
+                signature = _file_signature(json_file)
+            except OSError:
+                continue
+            if signatures.get(json_file) != signature:
+                signatures[json_file] = signature
+                arrivals.append(json_file)
+
+        if arrivals:
+            table, entries = _load_json_chunk(arrivals)
+            rows = table.groupby('file') if len(table) else {}
+            for json_file in arrivals:
+                previous = tables.pop(json_file, None)
+                if previous is not None:
+                    changed.update(previous['name'].unique())
+                if 'error' not in entries[json_file]:
+                    tables[json_file] = rows.get_group(json_file).drop(columns='file')
+                    changed.update(tables[json_file]['name'].unique())
+            pending = pending + len(arrivals)
+
+        now = time.monotonic()
+        finished = duration is not None and now-started >= duration
+        if pending and (finished or (every_n is None and every_seconds is None) or (every_n is not None and pending >= every_n) or (every_seconds is not None and now-last >= every_seconds)):
+            table = pd.concat([tables[json_file] for json_file in sorted(tables)], ignore_index=True) if tables else pd.DataFrame(columns=['name','x','y','z','radius','color','ligand'])
+            if changed:
+                update = table[table['name'].isin(changed)]
+                concensus, links = compute_concensus_pharmacophore(update, save_data_per_descriptor=False, h_dist=h_dist) if len(update) else (pd.DataFrame(), {})
+                for name in changed:
+                    descriptors[name] = (concensus[concensus['name'] == name] if len(concensus) else concensus, links.get(name))
+
+            snapshot = [descriptors[name][0] for name in sorted(descriptors) if len(descriptors[name][0])]
+            concensus = pd.concat(snapshot, ignore_index=True) if snapshot else pd.DataFrame()
+            concensus.index = concensus.index + 1
+            links = {name:descriptors[name][1] for name in sorted(descriptors) if descriptors[name][1] is not None}
+
+            if out_file is not None and len(concensus):
+                __publish_concensus(concensus, out_file)
+            if verbose:
+                print(f"{len(tables)} pharmacophores, {len(table)} points: {len(concensus)} consensus points ({pending} changes, {len(changed)} descriptors updated)")
+
+            changed, pending, last = set(), 0, now
+            yield concensus, links, table
+
+        if finished:
+            return
+        time.sleep(poll_interval)
@@ -1,16 +1,27 @@
 __version__ = "0.1.0"
 __author__  = "https://github.com/AngelRuizMoreno"
 
-''' 
-################### PHARMIT EXECUTABLE ###################
-'''
-from importlib_resources import files
-
-__PHARMIT      = files("conphar.bin").joinpath("pharmitserver")
-__PHARMIT_LIC  = files("conphar.bin").joinpath("README")
-
-
-import os, subprocess, json
+import os, json, tempfile, asyncio, itertools, glob
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import xml.etree.ElementTree as ElementTree
+
+try:
+    # optional, several times faster than json on large PHARMIT documents
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    # optional, needed by the Parquet point caches
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+try:
+    # POSIX only, locks the point caches and the pharmacophore stores while they are written
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import pandas as pd
 
@@ -20,15 +31,69 @@ import plotly.figure_factory as ff
 import plotly.graph_objects as go
 from pymol import cmd
 
-from scipy.spatial import distance_matrix
+from scipy.spatial import distance_matrix, cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 import scipy.cluster.hierarchy as sch
 from sklearn.preprocessing import normalize
 import numpy as np
 import seaborn as sns
 
-__all__=['get_ligand_receptor_pharmacophore','get_molecule_pharmacophore','parse_json_pharmacophore','show_pharmacophoric_descriptors','save_pharmacophore_to_pymol','compute_concensus_pharmacophore']
+from ._pharmit import _PHARMIT, _USAGE, _USAGE_LOCK, _pharma, _pharma_async
+from ._readers import _COLOR_CODE, _FEATURE_TYPES, _COLOR_DTYPE, _FEATURE_COLORS, _scan_json_file, _parse_pharmacophore_data, _flatten_svectors, _iter_json_documents, _load_json_chunk, _file_signature
+
+# Layout version of the Parquet point caches, caches of other versions are rebuilt
+__POINT_CACHE_VERSION = 2
+# The last point cache read in this process, keyed by its file name, inode, modification time and size
+__POINT_CACHE_MEMO = {}
+
+__all__=['get_ligand_receptor_pharmacophore','get_molecule_pharmacophore','get_ligand_receptor_pharmacophore_async','get_molecule_pharmacophore_async','record_pharmit_usage','parse_json_pharmacophore','EmbeddedStructure','load_pharmacophore_directory','iter_pharmacophore_queries','parse_pharmacophore_file','PharmacophoreSet','PharmacophoreStore','show_pharmacophoric_descriptors','save_pharmacophore_to_pymol','compute_concensus_pharmacophore']
+
+
+@contextmanager
+def record_pharmit_usage(out_file:str=None):
+    """Record the resources used by every PHARMIT process run inside a with block.
+
+    For each PHARMIT process started by any function of conphar (including the batch and asynchronous ones) while the block is active, a record is added with the command, the input files and their sizes in bytes, the start time, the wall time, the user and system CPU times in seconds, the peak resident memory in bytes, the exit code and whether it timed out. Outputs taken from the cache do not start a process and are not recorded. The peak memory is the high-water mark (VmHWM) of the process, read at the first wake-up after it starts, then at most every 0.5 s, and once more when PHARMIT closes its output; it is None only if the process had already exited at every reading. The CPU times and the peak memory are only available for synchronous calls; they are None for the asyncio variants.
+
+    Args:
+        out_file (str, optional): The file name of a report written when the block ends, in CSV format if its extension is '.csv' and in JSON format otherwise. Defaults to None (no report).
 
-def get_ligand_receptor_pharmacophore (receptor:str,ligand:str,out:str,out_format:str='json',cmd:str='pharma'):
+    Yields:
+        list: The list of records, which is filled while the block runs.
+
+    Example:
+        >>> with record_pharmit_usage('usage.csv') as usage:
+        ...     results = list(run_pharmacophore_batch('manifest.csv'))
+        >>> pd.DataFrame(usage).groupby('receptor').wall_time.sum().sort_values()
+    """
+    records = []
+    with _USAGE_LOCK:
+        _USAGE.append(records)
+    try:
+        yield records
+    finally:
+        with _USAGE_LOCK:
+            _USAGE.remove(records)
+
+        if out_file is not None:
+            if os.path.splitext(out_file)[1].lower() == '.csv':
+                pd.DataFrame(records, columns=['cmd','receptor','ligand','out','receptor_size','ligand_size','started','wall_time','user_time','system_time','max_rss','returncode','timed_out']).to_csv(out_file, index=False)
+            else:
+                with open(out_file, 'w') as file:
+                    json.dump(records, file, indent=1)
+
+
+def __piped_pharmacophore(ligand:str,returncode:int,output:bytes,errors:bytes):
+    """Parse the JSON output of a PHARMIT run read from a pipe, raising a RuntimeError with the standard error of PHARMIT if it failed or wrote nothing."""
+    errors = errors.decode(errors='replace').strip() if errors else ''
+    if returncode != 0:
+        raise RuntimeError(f"PHARMIT failed with exit code {returncode} for {ligand}" + (f": {errors}" if errors else ""))
+    if not output or not output.strip():
+        raise RuntimeError(f"PHARMIT wrote no output for {ligand}" + (f": {errors}" if errors else ""))
+    return _parse_pharmacophore_data(json.loads(output))
+
+def get_ligand_receptor_pharmacophore (receptor:str,ligand:str,out:str=None,out_format:str='json',cmd:str='pharma',cache_dir:str=None,cache_size:int=2**30,timeout:float=None,memory_limit:int=None,cpu_limit:int=None):
     
     """
     Generate a pharmacophore model for a ligand-receptor complex.
@@ -38,61 +103,172 @@ def get_ligand_receptor_pharmacophore (receptor:str,ligand:str,out:str,out_forma
     Args:
         receptor (str): The file name of the receptor structure in PDB format.
         ligand (str): The file name of the ligand structure in SDF or MOL2 format.
-        out (str): The base name of the output file.
+        out (str, optional): The base name of the output file. If None, the JSON output is read from a pipe instead of a file and returned parsed. Defaults to None.
         out_format (str, optional): The format of the output file. Defaults to 'json'.
         cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        cache_dir (str, optional): A folder where outputs are cached by the contents of the input files, the arguments and the PHARMIT binary. A cached output is copied to the output file without running PHARMIT. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes; the least recently used outputs are removed beyond it. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of PHARMIT in seconds; PHARMIT is killed when it expires. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of PHARMIT in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of PHARMIT in seconds. Defaults to None (no limit).
 
     Returns:
-        None
+        None or tuple: None when the output is written to a file, otherwise the (table, lig, receptor) tuple returned by parse_json_pharmacophore.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout.
+        RuntimeError: If out is None and PHARMIT failed or wrote no output, with the standard error of PHARMIT.
 
     Example:
         >>> get_ligand_receptor_pharmacophore('receptor.pdb', 'ligand.sdf', 'pharmacophore')
         b'{"pharmacophore": [{"type": "hydrophobic", "center": [1.2, 3.4, 5.6], "radius": 1.5}, ...]}'
+        >>> table, lig, rec = get_ligand_receptor_pharmacophore('receptor.pdb', 'ligand.sdf')
     """
-    args = (__PHARMIT,"-cmd", cmd, "-receptor", receptor, "-in", ligand, "-out", f'{out}.{out_format}')
+    if out is None:
+        return __piped_pharmacophore(ligand, *_pharma(ligand=ligand, receptor=receptor, cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, capture_stderr=True))
+
+    args = (_PHARMIT,"-cmd", cmd, "-receptor", receptor, "-in", ligand, "-out", f'{out}.{out_format}')
     print(args)
-    popen = subprocess.Popen(args, stdout=subprocess.PIPE)
-    popen.wait()
-    output = popen.stdout.read()
+    returncode, output = _pharma(ligand=ligand, out_file=f'{out}.{out_format}', receptor=receptor, cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit)
     
-def get_molecule_pharmacophore (ligand:str,out:str,out_format:str='json',cmd:str='pharma'):
+def get_molecule_pharmacophore (ligand:str,out:str=None,out_format:str='json',cmd:str='pharma',cache_dir:str=None,cache_size:int=2**30,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,engine:str='pharmit'):
     """
     Generate a pharmacophore model for a molecule.
 
     This function uses the PHARMIT tool to create a pharmacophore model based on the features and properties of a molecule. The output can be in JSON or XML format.
 
+    With engine='numpy', the features are perceived in-process instead, without running PHARMIT: the molecule is read in Python and the PHARMIT feature definitions (aromatic rings, hydrogen donors and acceptors with their vectors, ions and hydrophobic groups) are matched with NumPy masks over its atoms and bonds. The points have the same names, radii, sizes and vectors as the PHARMIT ones; on the example files they agree with PHARMIT except for a few ring aromaticity decisions of OpenBabel. Only JSON outputs are written, and the PHARMIT options (cmd, cache, limits) are ignored. The points of all the molecules of a multi-molecule file are merged.
+
     Args:
-        ligand (str): The file name of the molecule structure in SDF or MOL2 format.
-        out (str): The base name of the output file.
+        ligand (str): The file name of the molecule structure in SDF or MOL2 format (or PDB with engine='numpy').
+        out (str, optional): The base name of the output file. If None, the JSON output is read from a pipe instead of a file and returned parsed. Defaults to None.
         out_format (str, optional): The format of the output file. Defaults to 'json'.
         cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        cache_dir (str, optional): A folder where outputs are cached by the contents of the input files, the arguments and the PHARMIT binary. A cached output is copied to the output file without running PHARMIT. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes; the least recently used outputs are removed beyond it. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of PHARMIT in seconds; PHARMIT is killed when it expires. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of PHARMIT in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of PHARMIT in seconds. Defaults to None (no limit).
+        engine (str, optional): 'pharmit' to run PHARMIT, or 'numpy' to perceive the features in-process. Defaults to 'pharmit'.
 
     Returns:
-        None
+        None or tuple: None when the output is written to a file, otherwise the (table, lig, receptor) tuple returned by parse_json_pharmacophore.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout.
+        RuntimeError: If out is None and PHARMIT failed or wrote no output, with the standard error of PHARMIT.
+        ValueError: If engine is unknown, or engine is 'numpy' and the output format is not JSON or the file has no molecule.
 
     Example:
         >>> get_molecule_pharmacophore('ligand.sdf', 'pharmacophore')
         b'{"pharmacophore": [{"type": "hydrophobic", "center": [1.2, 3.4, 5.6], "radius": 1.5}, ...]}'
+        >>> table, lig, rec = get_molecule_pharmacophore('ligand.sdf')
+        >>> table, lig, rec = get_molecule_pharmacophore('ligand.sdf', engine='numpy')
     """
-    args = (__PHARMIT,"-cmd", cmd, "-in", ligand, "-out", f'{out}.{out_format}')
-    popen = subprocess.Popen(args, stdout=subprocess.PIPE)
-    popen.wait()
-    output = popen.stdout.read()
+    if engine == 'numpy':
+        if out is not None and out_format != 'json':
+            raise ValueError("The numpy engine only writes JSON outputs")
+        molecules = __perceive_file(ligand)
+        if not molecules:
+            raise ValueError(f"No molecule in {ligand}")
+        points = [point for molecule in molecules for point in molecule]
+        if out is None:
+            return _parse_pharmacophore_data({'points':points})
+        with open(f'{out}.{out_format}', 'w') as file:
+            json.dump({'points':points}, file, indent=1)
+        return
+    if engine != 'pharmit':
+        raise ValueError(f"Unknown engine {engine}, use 'pharmit' or 'numpy'")
+
+    if out is None:
+        return __piped_pharmacophore(ligand, *_pharma(ligand=ligand, cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, capture_stderr=True))
+
+    returncode, output = _pharma(ligand=ligand, out_file=f'{out}.{out_format}', cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit)
     
 
-def parse_json_pharmacophore (json_file:str):
+async def get_ligand_receptor_pharmacophore_async (receptor:str,ligand:str,out:str=None,out_format:str='json',cmd:str='pharma',cache_dir:str=None,cache_size:int=2**30,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,semaphore:asyncio.Semaphore=None):
+    """
+    Generate a pharmacophore model for a ligand-receptor complex without blocking the event loop.
+
+    This coroutine is the asyncio version of get_ligand_receptor_pharmacophore. PHARMIT runs as an asyncio subprocess, at most as many at a time as the semaphore allows, and it is killed if the coroutine is cancelled.
+
+    Args:
+        receptor (str): The file name of the receptor structure in PDB format.
+        ligand (str): The file name of the ligand structure in SDF or MOL2 format.
+        out (str, optional): The base name of the output file. If None, the parsed pharmacophore is returned instead of being written. Defaults to None.
+        out_format (str, optional): The format of the output file. Defaults to 'json'.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        cache_dir (str, optional): The folder of the PHARMIT output cache, see get_ligand_receptor_pharmacophore. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of PHARMIT in seconds; PHARMIT is killed when it expires. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of PHARMIT in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of PHARMIT in seconds. Defaults to None (no limit).
+        semaphore (asyncio.Semaphore, optional): The semaphore limiting the number of concurrent PHARMIT processes. Defaults to a semaphore shared by all calls in the event loop, sized to the number of CPUs.
+
+    Returns:
+        None or tuple: None when the output is written to a file, otherwise the (table, lig, receptor) tuple returned by parse_json_pharmacophore.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout.
+        RuntimeError: If out is None and PHARMIT failed or wrote no output, with the standard error of PHARMIT.
+
+    Example:
+        >>> results = await asyncio.gather(*[get_ligand_receptor_pharmacophore_async(rec, lig) for rec, lig in pairs])
+    """
+    if out is None:
+        return __piped_pharmacophore(ligand, *await _pharma_async(ligand=ligand, receptor=receptor, cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, semaphore=semaphore, capture_stderr=True))
+
+    returncode, output = await _pharma_async(ligand=ligand, out_file=f'{out}.{out_format}', receptor=receptor, cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, semaphore=semaphore)
+
+async def get_molecule_pharmacophore_async (ligand:str,out:str=None,out_format:str='json',cmd:str='pharma',cache_dir:str=None,cache_size:int=2**30,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,semaphore:asyncio.Semaphore=None):
+    """
+    Generate a pharmacophore model for a molecule without blocking the event loop.
+
+    This coroutine is the asyncio version of get_molecule_pharmacophore, see get_ligand_receptor_pharmacophore_async.
+
+    Args:
+        ligand (str): The file name of the molecule structure in SDF or MOL2 format.
+        out (str, optional): The base name of the output file. If None, the parsed pharmacophore is returned instead of being written. Defaults to None.
+        out_format (str, optional): The format of the output file. Defaults to 'json'.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        cache_dir (str, optional): The folder of the PHARMIT output cache, see get_ligand_receptor_pharmacophore. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of PHARMIT in seconds; PHARMIT is killed when it expires. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of PHARMIT in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of PHARMIT in seconds. Defaults to None (no limit).
+        semaphore (asyncio.Semaphore, optional): The semaphore limiting the number of concurrent PHARMIT processes. Defaults to a semaphore shared by all calls in the event loop, sized to the number of CPUs.
+
+    Returns:
+        None or tuple: None when the output is written to a file, otherwise the (table, lig, receptor) tuple returned by parse_json_pharmacophore.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout.
+        RuntimeError: If out is None and PHARMIT failed or wrote no output, with the standard error of PHARMIT.
+
+    Example:
+        >>> table, lig, rec = await get_molecule_pharmacophore_async('ligand.sdf')
+    """
+    if out is None:
+        return __piped_pharmacophore(ligand, *await _pharma_async(ligand=ligand, cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, semaphore=semaphore, capture_stderr=True))
+
+    returncode, output = await _pharma_async(ligand=ligand, out_file=f'{out}.{out_format}', cmd=cmd, cache_dir=cache_dir, cache_size=cache_size, timeout=timeout, memory_limit=memory_limit, cpu_limit=cpu_limit, semaphore=semaphore)
+    
+
+def parse_json_pharmacophore (json_file:str,lazy:bool=False,cache_file:str=None):
     """Parse a JSON file containing a pharmacophore model.
 
     This function reads a JSON file that contains a pharmacophore model generated by PHARMIT and returns a pandas DataFrame with the pharmacophore points and their colors, as well as the ligand and receptor structural data in MOL and MOL strings (if applicable).
 
     Args:
         json_file (str): The file name of the JSON file containing the pharmacophore model.
+        lazy (bool, optional): A boolean indicating whether to decode only the pharmacophore points. The ligand and receptor structures are then returned as EmbeddedStructure objects that keep their byte offsets in the file and read them on first access, which cuts the parse time and the memory of large collections. Defaults to False.
+        cache_file (str, optional): The file name of a Parquet point cache shared with load_pharmacophore_directory, which requires pyarrow. The points are read from the cache while the modification time and size of the JSON file are unchanged, otherwise the file is parsed. The cache is only written by load_pharmacophore_directory, in one batch per folder. Defaults to None (no cache).
 
     Returns:
         tuple: A tuple of three elements:
-            - table (pd.DataFrame): A DataFrame with the columns 'name', 'center', 'radius', and 'color' for each pharmacophore point.
-            - lig (str): The file name of the ligand structure used to generate the pharmacophore model.
-            - receptor (str): The file name of the receptor structure used to generate the pharmacophore model.
+            - table (pd.DataFrame): A DataFrame with the columns 'name', 'center', 'radius', and 'color' for each pharmacophore point ('name' and 'color' are Categoricals with the codes of the feature type registry), and the svector components 'sv_x', 'sv_y' and 'sv_z' (NaN for the points without vector) with the mask 'has_vector'.
+            - lig (str or EmbeddedStructure): The file name of the ligand structure used to generate the pharmacophore model.
+            - receptor (str or EmbeddedStructure): The file name of the receptor structure used to generate the pharmacophore model.
 
     Example:
         >>> table, lig, receptor = parse_json_pharmacophore('pharmacophore.json')
@@ -104,31 +280,1335 @@ def parse_json_pharmacophore (json_file:str):
         'ligand data'
         >>> receptor
         'receptor data'
+        >>> table, lig, receptor = parse_json_pharmacophore('pharmacophore.json', lazy=True)
+        >>> receptor
+        EmbeddedStructure('pharmacophore.json', 512000 bytes)
+        >>> str(receptor)[:6]
+        'HEADER'
     """
     
-    
-    color_code={ 'Hydrophobic':        'green',\
-                 'HydrogenAcceptor':   'orange',\
-                 'HydrogenDonor':      'white',\
-                 'Aromatic':           'purple',\
-                 'NegativeIon':        'red',\
-                 'PositiveIon':        'navy',\
-                 'InclusionSphere':    'gray',\
-                 'Other':              'yellow',\
-                 'PhenylalanineAnalog':'pink',\
-                 'LeuValAnalog':       'pink' \
-                 }
+    if cache_file is not None:
+        return __parse_cached_pharmacophore(json_file, cache_file, lazy)
+
+    if lazy:
+        data, offsets = _scan_json_file(json_file, decode=('points',))
+        for key in ('ligand', 'receptor'):
+            if key in offsets:
+                data[key] = EmbeddedStructure(json_file, *offsets[key])
+        return _parse_pharmacophore_data(data)
     
     with open (json_file, 'r') as file:
         data = json.load(file)
-        table=pd.DataFrame(data.get('points'))
-    
-    table['color']=table['name'].map(color_code)
 
-    lig=data.get('ligand')
-    receptor=data.get('receptor')
+    return _parse_pharmacophore_data(data)
+
+
+class EmbeddedStructure:
+    """A ligand or receptor structure embedded in a PHARMIT JSON file, read from the file on first access.
+
+    The object keeps the byte offsets of the JSON string in the file and decodes it the first time its text is used (str, len, ==, or any str method such as splitlines), then keeps the text. The file must not change in between.
+
+    Args:
+        json_file (str): The file name of the JSON file.
+        start (int): The byte offset of the opening quote of the JSON string.
+        end (int): The byte offset after the closing quote of the JSON string.
+    """
+
+    def __init__(self, json_file:str, start:int, end:int):
+        self.json_file, self.start, self.end = json_file, start, end
+        self._text = None
+
+    @property
+    def text(self):
+        """str: The structure, decoded from the file on first access."""
+        if self._text is None:
+            with open(self.json_file, 'rb') as file:
+                file.seek(self.start)
+                data = file.read(self.end-self.start)
+            self._text = orjson.loads(data) if orjson is not None else json.loads(data)
+        return self._text
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.text, name)
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return len(self.text)
+
+    def __eq__(self, other):
+        return self.text == str(other)
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __repr__(self):
+        return f"EmbeddedStructure('{self.json_file}', {self.end-self.start} bytes)"
+
+
+def __feature_codes(names:pd.Series):
+    """Return the integer codes of the feature names of a pharmacophore table and the names of the codes."""
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        return names.cat.codes.to_numpy(), names.cat.categories
+    codes, categories = pd.factorize(names, sort=True)
+    return codes, categories
+
+
+def __parse_cached_pharmacophore(json_file:str,cache_file:str,lazy:bool=False):
+    """Return the pharmacophore table and structures of a JSON file from a point cache, parsing the file and updating the cache when its entry is missing or stale, see parse_json_pharmacophore."""
+    json_file = os.path.abspath(json_file)
+    cached, entries = __read_point_cache(cache_file)
+
+    entry = entries.get(json_file)
+    if entry is None or entry.get('signature') != _file_signature(json_file):
+        # the cache is only written by load_pharmacophore_directory, in one batch per folder, so a missing or stale file is parsed on its own
+        cached, entries = _load_json_chunk([json_file])
+        entry = entries[json_file]
+
+    if 'error' in entry:
+        raise ValueError(f"{json_file}: {entry['error']}")
+
+    table = cached[cached['file'] == json_file][entry['columns']].reset_index(drop=True)
+    structures = [EmbeddedStructure(json_file, *entry['offsets'][key]) if key in entry['offsets'] else None for key in ('ligand', 'receptor')]
+    if not lazy:
+        structures = [None if structure is None else structure.text for structure in structures]
+
+    return table, *structures
+
+
+@contextmanager
+def _file_lock(lock_file:str):
+    """Hold an exclusive lock on a lock file while the block runs, so that the writers of the same cache or store in other threads and processes wait for each other. Does nothing where fcntl is not available."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_file, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def __read_point_cache(cache_file:str):
+    """Read a point cache written by __write_point_cache, returning its table (with the 'file' column) and its entries, or an empty cache if the file does not exist or cannot be read. The last cache read is kept in memory while its file is unchanged."""
+    if pq is None:
+        raise ImportError("The point cache requires pyarrow (pip install pyarrow)")
+    try:
+        stat = os.stat(cache_file)
+        key = (os.path.abspath(cache_file), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return pd.DataFrame(), {}
+    if key in __POINT_CACHE_MEMO:
+        table, entries = __POINT_CACHE_MEMO[key]
+        return table, dict(entries)
+
+    try:
+        cached = pq.read_table(cache_file)
+        metadata = json.loads(cached.schema.metadata[b'conphar'])
+        if metadata.get('version') != __POINT_CACHE_VERSION:
+            return pd.DataFrame(), {}
+        entries = metadata['entries']
+    except (OSError, KeyError, TypeError, ValueError, pa.ArrowException):
+        return pd.DataFrame(), {}
+
+    # nested columns come back as arrays of dicts and None, restore the lists and NaN of the parsed tables
+    nested = [name for name in cached.column_names if pa.types.is_nested(cached.schema.field(name).type)]
+    table = cached.drop_columns(nested).to_pandas()
+    for name in nested:
+        table[name] = [np.nan if value is None else value for value in cached.column(name).to_pylist()]
+    table = table[cached.column_names]
+
+    __POINT_CACHE_MEMO.clear()
+    __POINT_CACHE_MEMO[key] = (table, entries)
+    return table, dict(entries)
+
+
+def __write_point_cache(cache_file:str,table:pd.DataFrame,entries:dict):
+    """Write a point table (with the 'file' column) and the entries of its files to a Parquet cache file, replacing it atomically under the lock file cache_file.lock."""
+    table = table.copy()
+    for name in table.columns[table.dtypes == object]:
+        table[name] = table[name].where(table[name].notna(), None)
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    arrow_table = arrow_table.replace_schema_metadata({**(arrow_table.schema.metadata or {}), b'conphar':json.dumps({'version':__POINT_CACHE_VERSION, 'entries':entries}).encode()})
+
+    folder = os.path.dirname(os.path.abspath(cache_file))
+    os.makedirs(folder, exist_ok=True)
+    with _file_lock(f'{cache_file}.lock'):
+        with tempfile.NamedTemporaryFile(dir=folder, suffix='.parquet', delete=False) as temporary:
+            pass
+        try:
+            pq.write_table(arrow_table, temporary.name)
+            os.replace(temporary.name, cache_file)
+        except BaseException:
+            os.remove(temporary.name)
+            raise
+
+
+def load_pharmacophore_directory(folder:str,pattern:str='*.json',n_workers:int=None,chunk_size:int=256,cache_file:str=None,verbose:bool=True):
+    """Load all the PHARMIT JSON pharmacophores of a folder into one pharmacophore table.
+
+    This function globs the folder and parses the JSON files in parallel on a pool of worker processes, with orjson when it is installed. Each row is tagged with its source ligand (the file name without extension) and the tables are concatenated once, which replaces the loop of parse_json_pharmacophore and pd.concat calls of the tutorial. Only the points are decoded: the ligand and receptor structures embedded in the files are skipped without being read into memory. Files that are not valid pharmacophores or have no points are skipped.
+
+    With a cache_file, the flattened point table of the folder is kept in a Parquet file together with the modification time and size of every JSON file. Reopening the folder is then a single columnar read: only the files that were added or changed since the cache was written are parsed again, and the cache is rewritten with the current files of the folder.
+
+    Args:
+        folder (str): The folder containing the JSON files.
+        pattern (str, optional): The glob pattern of the files to load, relative to the folder (e.g. '**/*.json' to include the subfolders). Defaults to '*.json'.
+        n_workers (int, optional): The number of worker processes. Defaults to the number of CPUs of the machine.
+        chunk_size (int, optional): The number of files parsed by a worker at a time. Folders with fewer files are parsed in the calling process. Defaults to 256.
+        cache_file (str, optional): The file name of the Parquet point cache, which requires pyarrow. Defaults to None (no cache).
+        verbose (bool, optional): A boolean indicating whether to print the files that could not be loaded and a summary. Defaults to True.
+
+    Returns:
+        pd.DataFrame: A DataFrame with one row per pharmacophore point, with the columns of parse_json_pharmacophore plus 'ligand', sorted by file name.
+
+    Raises:
+        ImportError: If a cache_file is given and pyarrow is not installed.
+
+    Example:
+        >>> p4_table = load_pharmacophore_directory('Example/pharmacophores/', cache_file='Example/pharmacophores.parquet')
+        >>> p4_table[['name','x','y','z','ligand']].head()
+                      name      x      y       z ligand
+        0  HydrogenAcceptor  8.507 -3.446  27.187   5R7Y
+        1       Hydrophobic  9.948 -5.500  26.143   5R7Y
+        ... ... ... ... ... ...
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    json_files = sorted(os.path.abspath(json_file) for json_file in glob.glob(os.path.join(folder, pattern), recursive=True))
+
+    cached, entries, signatures, stale = pd.DataFrame(), {}, {}, False
+    if cache_file is not None:
+        cached, entries = __read_point_cache(cache_file)
+        signatures = {json_file:_file_signature(json_file) for json_file in json_files}
+        fresh = {json_file:entry for json_file, entry in entries.items() if json_file in signatures and entry.get('signature') == signatures[json_file]}
+        stale, entries = len(fresh) != len(entries), fresh
+        if len(cached):
+            cached = cached[cached['file'].isin(list(entries))]
+
+    parse = [json_file for json_file in json_files if json_file not in entries]
+    chunks = [parse[i:i+chunk_size] for i in range(0, len(parse), chunk_size)]
+
+    if len(chunks) > 1 and n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_load_json_chunk, chunks))
+    else:
+        results = [_load_json_chunk(chunk) for chunk in chunks]
+
+    for _, chunk_entries in results:
+        entries.update({json_file:{**entry, 'signature':signatures.get(json_file)} for json_file, entry in chunk_entries.items()})
+
+    tables = [table for table in [cached]+[table for table, _ in results] if len(table)]
+    table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=['name','x','y','z','radius','color','ligand','file'])
+    if len(cached) and len(tables) > 1:
+        order = {json_file:i for i, json_file in enumerate(json_files)}
+        table = table.iloc[np.argsort(table['file'].map(order).to_numpy(), kind='stable')].reset_index(drop=True)
+
+    if cache_file is not None and (parse or stale or not os.path.exists(cache_file)):
+        __write_point_cache(cache_file, table, {json_file:entries[json_file] for json_file in json_files})
+
+    if verbose:
+        for json_file in json_files:
+            if 'error' in entries.get(json_file, {}):
+                print(f"{json_file}: skipped ({entries[json_file]['error']})")
+        print(f"{table['ligand'].nunique()} pharmacophores, {len(table)} points loaded from {folder}" + (f" ({len(json_files)-len(parse)} files from the cache)" if cache_file is not None else ""))
+
+    return table.drop(columns='file')
+
+
+''' 
+################### QUERY FORMATS ###################
+'''
+# Feature names of the MOE (.ph4) and LigandScout (.pml) queries
+__MOE_FEATURES = {'Hyd':'Hydrophobic', 'Don':'HydrogenDonor', 'Acc':'HydrogenAcceptor', 'Aro':'Aromatic', 'PiR':'Aromatic', 'Cat':'PositiveIon', 'Ani':'NegativeIon'}
+__PML_FEATURES = {'H':'Hydrophobic', 'HBD':'HydrogenDonor', 'HBA':'HydrogenAcceptor', 'AR':'Aromatic', 'PI':'PositiveIon', 'NI':'NegativeIon'}
+
+
+def __query_point(name:str,x:float,y:float,z:float,radius:float=None,vectors:list=(),enabled:bool=True):
+    """Build a pharmacophore point in the PHARMIT JSON format, with the mean of the unit vectors as svector (the first one for opposite vectors)."""
+    point = {'enabled':enabled, 'name':name, 'radius':__FEATURE_RADII.get(name, 1.0) if radius is None else radius}
+    if len(vectors):
+        units = [np.asarray(vector)/np.linalg.norm(vector) for vector in vectors if np.linalg.norm(vector) > 0]
+        if units:
+            # opposite vectors (ring normals) keep the first one
+            svector = np.mean(units, axis=0) if np.linalg.norm(np.mean(units, axis=0)) > 1e-6 else units[0]
+            point['svector'] = dict(zip('xyz', map(float, svector)))
+        point['vector'] = [dict(zip('xyz', map(float, vector))) for vector in vectors]
+    point.update(x=float(x), y=float(y), z=float(z))
+    return point
+
+
+def __read_json_queries(file_name:str):
+    """Yield the points of the pharmacophores of a PHARMIT JSON (.json or .query) file, one per JSON document."""
+    with open(file_name) as file:
+        for i, document in enumerate(_iter_json_documents(file)):
+            yield f"{i}", document.get('points') or []
+
+
+def __read_text_queries(file_name:str):
+    """Yield the points of the pharmacophore of a PHARMIT/Pharmer text file (lines 'name x y z [ vx vy vz ] ...'). PHARMIT writes the points of all the molecules of an input without any separator, so the file is read as one pharmacophore; blank and comment lines are skipped."""
+    points = []
+    with open(file_name) as file:
+        for line in file:
+            tokens = line.replace('[', ' [ ').replace(']', ' ] ').split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            name, coordinates, vectors, vector = tokens[0], tokens[1:4], [], None
+            for token in tokens[4:]:
+                if token == '[':
+                    vector = []
+                elif token == ']':
+                    vectors.append([float(value) for value in vector])
+                    vector = None
+                elif vector is not None:
+                    vector.append(token)
+            points.append(__query_point(name, *map(float, coordinates), vectors=vectors))
+    yield "0", points
+
+
+def __read_moe_queries(file_name:str):
+    """Yield the points of the pharmacophores of a MOE (.ph4) file, one per '#moe' header, from the columns of its '#feature' tables (vectors are not read)."""
+    points, count, columns, values, remaining = [], 0, None, [], 0
+    with open(file_name) as file:
+        for line in file:
+            if line.startswith('#moe'):
+                if points:
+                    yield f"{count}", points
+                    points, count = [], count+1
+                remaining = 0
+                continue
+            if line.startswith('#feature'):
+                tokens = line.split()
+                columns, values = tokens[2::2], []
+                remaining = int(tokens[1])*len(columns)
+                continue
+            if remaining <= 0 or line.startswith('#'):
+                continue
+
+            tokens = line.split()[:remaining]
+            values.extend(tokens)
+            remaining = remaining-len(tokens)
+            if remaining == 0:
+                for row in range(0, len(values), len(columns)):
+                    feature = dict(zip(columns, values[row:row+len(columns)]))
+                    names = dict.fromkeys(__MOE_FEATURES[expression] for expression in feature.get('expr', '').split('|') if expression in __MOE_FEATURES)
+                    for name in names:
+                        points.append(__query_point(name, float(feature['x']), float(feature['y']), float(feature['z']), float(feature['r']) if 'r' in feature else None, enabled=feature.get('active', '1') != '0'))
+    if points:
+        yield f"{count}", points
+
+
+def __read_pml_queries(file_name:str):
+    """Yield the points of the pharmacophores of a LigandScout (.pml) XML file, parsing it incrementally and releasing each pharmacophore element once read (exclusion volumes are skipped)."""
+    def local(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def position(element):
+        return [float(element.get(f'{axis}3')) for axis in 'xyz']
+
+    root, count = None, 0
+    for event, element in ElementTree.iterparse(file_name, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event != 'end' or local(element.tag) != 'pharmacophore':
+            continue
+
+        points = []
+        for feature in element:
+            name = __PML_FEATURES.get(feature.get('name'))
+            children = {local(child.tag):child for child in feature}
+            if name is None:
+                continue
+            enabled = feature.get('disabled', 'false') != 'true'
+            if local(feature.tag) == 'point' and 'position' in children:
+                points.append(__query_point(name, *position(children['position']), float(children['position'].get('tolerance'.get(name, 1.0))), enabled=enabled))
+            elif local(feature.tag) == 'vector' and 'origin' in children and 'target' in children:
+                # the ligand side is the origin, unless the vector points to the ligand
+                ligand, partner = ('target', 'origin') if feature.get('pointsToLigand') == 'true' else ('origin', 'target')
+                center = position(children[ligand])
+                points.append(__query_point(name, *center, float(children[ligand].get('tolerance'.get(name, 1.0))), [np.subtract(position(children[partner]), center)], enabled=enabled))
+            elif local(feature.tag) == 'plane' and 'position' in children and 'normal' in children:
+                normal = np.asarray(position(children['normal']))
+                points.append(__query_point(name, *position(children['position']), float(children['position'].get('tolerance'.get(name, 1.0))), [normal, -normal], enabled=enabled))
+
+        yield element.get('name') or f"{count}", points
+        count = count+1
+        element.clear()
+        if root is not element:
+            root.clear()
+
+
+__QUERY_READERS = {'.json':__read_json_queries, '.query':__read_json_queries, '.txt':__read_text_queries, '.ph4':__read_moe_queries, '.pml':__read_pml_queries}
+
+
+def iter_pharmacophore_queries(file_name:str):
+    """Read the pharmacophores of a query file one at a time.
+
+    This function parses the pharmacophore query formats accepted by PHARMIT as a stream, so that files with many pharmacophores are processed with bounded memory: PHARMIT JSON (.json, .query), PHARMIT/Pharmer text (.txt, as written by get_molecule_pharmacophore with out_format='txt', one pharmacophore per file since PHARMIT writes no separator between molecules), MOE (.ph4) and LigandScout XML (.pml, read incrementally with iterparse). Each pharmacophore is returned as a table in the format of parse_json_pharmacophore. The points of the text files take the default PHARMIT radii, and the vectors of the MOE files are not read.
+
+    Args:
+        file_name (str): The file name of the query file. The format is given by its extension.
+
+    Yields:
+        tuple: A tuple of two elements:
+            - name (str): The name of the pharmacophore (the 'name' attribute of LigandScout files, its position in the file otherwise).
+            - table (pd.DataFrame): The pharmacophore table, as returned by parse_json_pharmacophore.
+
+    Raises:
+        ValueError: If the extension of the file is not a supported query format.
+
+    Example:
+        >>> store = PharmacophoreStore('queries_store')
+        >>> for name, table in iter_pharmacophore_queries('queries.pml'):
+        ...     store.append(table.assign(ligand=name))
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in __QUERY_READERS:
+        raise ValueError(f"Unsupported pharmacophore query format: {extension} (use {', '.join(__QUERY_READERS)})")
+
+    for name, points in __QUERY_READERS[extension](file_name):
+        if points:
+            yield name, _parse_pharmacophore_data({'points':points})[0]
+
+
+def parse_pharmacophore_file(file_name:str):
+    """Parse all the pharmacophores of a query file into one pharmacophore table.
+
+    This function reads a PHARMIT JSON, PHARMIT/Pharmer text, MOE (.ph4) or LigandScout (.pml) file with iter_pharmacophore_queries and concatenates its pharmacophores once, tagging each point with the name of its pharmacophore in the 'ligand' column.
+
+    Args:
+        file_name (str): The file name of the query file. The format is given by its extension.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the columns of parse_json_pharmacophore plus 'ligand'.
+
+    Example:
+        >>> table = parse_pharmacophore_file('5R80.txt')
+        >>> table[['name','x','y','z']].head(2)
+                    name        x       y        z
+        0       Aromatic  12.0042  2.2201  23.6554
+        1  HydrogenDonor   9.0505  5.0012  22.9142
+    """
+    tables = [table.assign(ligand=name) for name, table in iter_pharmacophore_queries(file_name)]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=['name','x','y','z','radius','color','ligand'])
+
+
+''' 
+################### FEATURE PERCEPTION ###################
+'''
+# Radii of the pharmacophore points written by PHARMIT
+__FEATURE_RADII = {'Aromatic':1.1, 'HydrogenDonor':0.5, 'HydrogenAcceptor':0.5, 'PositiveIon':0.75, 'NegativeIon':0.75, 'Hydrophobic':1.0}
+# Allowed valences of the neutral elements, used to count the implicit hydrogens
+__VALENCES = {'B':(3,), 'C':(4,), 'N':(3,5), 'O':(2,), 'P':(3,5), 'S':(2,4,6), 'F':(1,), 'Cl':(1,), 'Br':(1,), 'I':(1,), 'Se':(2,4,6)}
+# Covalent radii (Å) used to find the bonds of PDB molecules without CONECT records
+__COVALENT_RADII = {'H':0.31, 'B':0.84, 'C':0.76, 'N':0.71, 'O':0.66, 'F':0.57, 'P':1.07, 'S':1.05, 'Cl':1.02, 'Br':1.20, 'I':1.39, 'Se':1.20}
+# Largest number of heavy atoms of a molecule perceived by the NumPy engine, whose bond matrices are dense (n x n)
+__MAX_PERCEIVED_ATOMS = 5000
+# Charges of the MDL atom block charge field
+__MDL_CHARGES = {1:3, 2:2, 3:1, 5:-1, 6:-2, 7:-3}
+
+
+def __element(symbol:str):
+    symbol = symbol.strip()
+    return symbol[:1].upper()+symbol[1:].lower()
+
+
+def __read_sdf_molecule(text:str):
+    """Read the atoms (element, coordinates, formal charge) and bonds (i, j, order, with 4 for aromatic) of a V2000 molfile block."""
+    lines = text.splitlines()
+    if len(lines) < 4 or 'V3000' in lines[3]:
+        raise ValueError("Only V2000 molfile blocks are supported")
+
+    n_atoms, n_bonds = int(lines[3][0:3]), int(lines[3][3:6])
+    elements, coords, charges = [], [], []
+    for line in lines[4:4+n_atoms]:
+        coords.append((float(line[0:10]), float(line[10:20]), float(line[20:30])))
+        elements.append(__element(line[31:34]))
+        charges.append(__MDL_CHARGES.get(int(line[36:39] or 0), 0) if len(line) >= 39 else 0)
+
+    bonds = [(int(line[0:3])-1, int(line[3:6])-1, int(line[6:9])) for line in lines[4+n_atoms:4+n_atoms+n_bonds]]
+
+    charged = False
+    for line in lines[4+n_atoms+n_bonds:]:
+        if line.startswith('M  END'):
+            break
+        if line.startswith('M  CHG'):
+            # the CHG properties supersede the charges of the atom block
+            if not charged:
+                charges, charged = [0]*n_atoms, True
+            fields = line.split()
+            for k in range(int(fields[2])):
+                charges[int(fields[3+2*k])-1] = int(fields[4+2*k])
+
+    return np.array(elements), np.array(coords, dtype=float).reshape(-1, 3), np.array(charges), bonds
+
+
+def __read_mol2_molecule(text:str):
+    """Read the atoms and bonds of a MOL2 molecule, with the formal charges implied by the SYBYL atom types."""
+    elements, coords, charges, types, ids, bonds = [], [], [], [], {}, []
+    section = None
+    for line in text.splitlines():
+        if line.startswith('@<TRIPOS>'):
+            section = line.strip()
+            continue
+        fields = line.split()
+        if section == '@<TRIPOS>ATOM' and len(fields) >= 6:
+            ids[fields[0]] = len(elements)
+            coords.append((float(fields[2]), float(fields[3]), float(fields[4])))
+            elements.append(__element(fields[5].split('.')[0]))
+            types.append(fields[5])
+            charges.append(1 if fields[5] == 'N.4' else 0)
+        elif section == '@<TRIPOS>BOND' and len(fields) >= 4:
+            bonds.append((ids[fields[1]], ids[fields[2]], {'1':1, '2':2, '3':3, 'ar':4}.get(fields[3], 1)))
+
+    # the two oxygens of a carboxylate (or sulfonate, phosphate) share a double bond and a negative charge
+    for center in {j if types[i] == 'O.co2' else i for i, j, order in bonds if 'O.co2' in (types[i], types[j])}:
+        oxygens = [k for k, (i, j, order) in enumerate(bonds) if center in (i, j) and types[j if i == center else i] == 'O.co2']
+        for n, k in enumerate(oxygens):
+            i, j, order = bonds[k]
+            bonds[k] = (i, j, 2 if n == 0 else 1)
+            if n > 0:
+                charges[j if i == center else i] = -1
+
+    return np.array(elements), np.array(coords, dtype=float).reshape(-1, 3), np.array(charges), bonds
+
+
+def __read_pdb_molecule(text:str):
+    """Read the atoms of a PDB molecule and its bonds, from the CONECT records (repeated records are multiple bonds) or from the distances."""
+    elements, coords, charges, serials = [], [], [], {}
+    conect = {}
+    for line in text.splitlines():
+        # only the first alternate location of each atom is read
+        if line.startswith(('ATOM  ', 'HETATM')) and line[16] in ' A1':
+            serials[line[6:11].strip()] = len(elements)
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            symbol = line[76:78].strip() or line[12:14].strip().lstrip('0123456789')
+            elements.append(__element(symbol))
+            charge = line[78:80].strip()
+            charges.append(int(charge[::-1]) if charge[:1].isdigit() else 0)
+        elif line.startswith('CONECT'):
+            atom = line[6:11].strip()
+            for k in range(11, 31, 5):
+                partner = line[k:k+5].strip()
+                if partner:
+                    conect[(atom, partner)] = conect.get((atom, partner), 0)+1
+
+    elements = np.array(elements)
+    coords = np.array(coords, dtype=float).reshape(-1, 3)
+
+    if conect:
+        orders = {}
+        for (a, b), count in conect.items():
+            if a in serials and b in serials:
+                i, j = sorted((serials[a], serials[b]))
+                orders[(i, j)] = max(orders.get((i, j), 1), min(count, 3))
+        bonds = [(i, j, order) for (i, j), order in sorted(orders.items())]
+    else:
+        # the candidate pairs come from a KD-tree within the longest possible bond, without the n x n distance matrix
+        radii = np.array([__COVALENT_RADII.get(element, 0.77) for element in elements])
+        pairs = cKDTree(coords).query_pairs(2*radii.max()+0.45 if len(radii) else 0, output_type='ndarray') if len(coords) > 1 else np.zeros((0, 2), dtype=int)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        distances = np.linalg.norm(coords[pairs[:, 0]]-coords[pairs[:, 1]], axis=1)
+        bonded = (distances < radii[pairs[:, 0]]+radii[pairs[:, 1]]+0.45) & (distances > 0.4)
+        bonds = [(i, j, 1) for i, j in pairs[bonded]]
+
+    charges = np.array(charges)
+    if bonds and all(order == 1 for i, j, order in bonds):
+        bonds = __guess_bond_orders(elements, coords, charges, bonds)
+
+    return elements, coords, charges, bonds
+
+
+def __guess_bond_orders(elements:np.ndarray,coords:np.ndarray,charges:np.ndarray,bonds:list):
+    """Guess the aromatic rings (planar 5- and 6-membered rings) and the double and triple bonds (short bonds, shortest first, within the valences) of a molecule read without bond orders."""
+    n = len(elements)
+    heavy = [(i, j) for i, j, order in bonds if elements[i] != 'H' and elements[j] != 'H']
+    aromatic = set()
+    for ring in __find_rings(n, heavy):
+        points = coords[ring]-coords[ring].mean(axis=0)
+        if len(ring) in (5, 6) and np.all(np.isin(elements[ring], ['C','N','O','S'])) and np.linalg.svd(points)[1][-1] < 0.1*np.sqrt(len(ring)):
+            aromatic.update(tuple(sorted((ring[k], ring[k-1]))) for k in range(len(ring)))
+
+    degree = np.bincount(np.array(heavy, dtype=int).reshape(-1), minlength=n) if heavy else np.zeros(n, dtype=int)
+    valence = np.array([max(__VALENCES.get(element, (0,))) for element in elements])+np.where(np.isin(elements, ['N','O','S','P']), charges, -np.abs(charges))
+    saturation = degree+np.isin(np.arange(n), [atom for k, (i, j, order) in enumerate(bonds) if tuple(sorted((i, j))) in aromatic for atom in (i, j)])
+
+    amidine = np.zeros(n, dtype=int)
+    for i, j in heavy:
+        amidine[i] += elements[i] == 'C' and elements[j] == 'N'
+        amidine[j] += elements[j] == 'C' and elements[i] == 'N'
+
+    # the shortest bonds are assigned first, except that guanidines take the double bond on their substituted nitrogen (N-epsilon of arginine), as OpenBabel does
+    guessed = list(bonds)
+    for k, (i, j, order) in sorted(enumerate(bonds), key=lambda item: (not (max(amidine[item[1][0]], amidine[item[1][1]]) >= 3 and min(degree[item[1][0]], degree[item[1][1]]) > 1), np.linalg.norm(coords[item[1][0]]-coords[item[1][1]]))):
+        pair = {elements[i], elements[j]}
+        length = np.linalg.norm(coords[i]-coords[j])
+        terminal = min(degree[i], degree[j]) <= 1
+        if tuple(sorted((i, j))) in aromatic:
+            guessed[k] = (i, j, 4)
+            continue
+        if pair <= {'C','N'} and length < (1.21 if 'N' in pair else 1.25) and terminal:
+            order = 3
+        elif (pair == {'C','O'} and length < 1.34 and terminal) or (pair == {'C'} and length < 1.38) or (pair == {'C','N'} and length < (1.35 if max(amidine[i], amidine[j]) >= 2 else 1.31)) \
+            or (pair in ({'S','O'}, {'P','O'}) and length < 1.55 and terminal):
+            order = 2
+        if order > 1 and saturation[i]+order-1 <= valence[i] and saturation[j]+order-1 <= valence[j]:
+            saturation[i], saturation[j] = saturation[i]+order-1, saturation[j]+order-1
+            guessed[k] = (i, j, order)
+
+    return guessed
+
+
+def __find_rings(n:int,edges:list):
+    """Find the smallest set of smallest rings of a molecular graph, each ring as the list of its atoms in order."""
+    neighbors = [[] for i in range(n)]
+    for i, j in edges:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+
+    index = {tuple(sorted(edge)):k for k, edge in enumerate(edges)}
+    # the number of independent rings is the cyclomatic number of the graph
+    components, seen = 0, set()
+    for start in range(n):
+        if start not in seen:
+            components, stack = components+1, [start]
+            seen.add(start)
+            while stack:
+                for j in neighbors[stack.pop()]:
+                    if j not in seen:
+                        seen.add(j)
+                        stack.append(j)
+    n_rings = len(edges)-n+components
+    if n_rings <= 0:
+        return []
+
+    # bridges (bonds in no ring) are found by depth-first search low links and skipped
+    order, low, bridges = {}, {}, set()
+    for start in range(n):
+        if start in order:
+            continue
+        order[start] = low[start] = len(order)
+        stack = [(start, None, iter(neighbors[start]))]
+        while stack:
+            atom, parent, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if parent is not None:
+                    low[parent] = min(low[parent], low[atom])
+                    if low[atom] > order[parent]:
+                        bridges.add(tuple(sorted((parent, atom))))
+            elif child not in order:
+                order[child] = low[child] = len(order)
+                stack.append((child, atom, iter(neighbors[child])))
+            elif child != parent:
+                low[atom] = min(low[atom], order[child])
+
+    # the smallest ring through each bond is the shortest path between its atoms that avoids the bond
+    candidates = {}
+    for i, j in edges:
+        if tuple(sorted((i, j))) in bridges:
+            continue
+        parent, queue = {i:None}, [i]
+        for atom in queue:
+            if atom == j:
+                break
+            for k in neighbors[atom]:
+                if k not in parent and not (atom == i and k == j):
+                    parent[k] = atom
+                    queue.append(k)
+        if j in parent:
+            ring, atom = [], j
+            while atom is not None:
+                ring.append(atom)
+                atom = parent[atom]
+            mask = sum(1 << index[tuple(sorted((ring[k], ring[k-1])))] for k in range(len(ring)))
+            candidates[mask] = ring
+
+    # keep the smallest rings that are independent over GF(2)
+    rings, basis = [], {}
+    for mask, ring in sorted(candidates.items(), key=lambda item: len(item[1])):
+        reduced = mask
+        while reduced:
+            pivot = reduced.bit_length()-1
+            if pivot not in basis:
+                basis[pivot] = reduced
+                rings.append(ring)
+                break
+            reduced = reduced ^ basis[pivot]
+        if len(rings) == n_rings:
+            break
+
+    return rings
+
+
+def __kekulize(elements:np.ndarray,charges:np.ndarray,hydrogens:np.ndarray,bonds:list):
+    """Assign alternating single and double bonds to the aromatic bonds (order 4).
+
+    The aromatic systems that cannot be kekulized with the hydrogens given by the valences (e.g. an indole without its N-H) are made aliphatic with single bonds, as OpenBabel does for PHARMIT, and their atoms keep the hydrogens of the aromatic valences.
+
+    Returns:
+        tuple: The bonds with the kekulized orders, and a dictionary with the number of implicit hydrogens of the atoms of the failed systems.
+    """
+    n = len(elements)
+    aromatic = [k for k, (i, j, order) in enumerate(bonds) if order == 4]
+    if not aromatic:
+        return bonds, {}
+
+    bonds = [list(bond) for bond in bonds]
+    saturation = np.zeros(n, dtype=int)
+    for i, j, order in bonds:
+        if order != 4:
+            saturation[i] += order
+            saturation[j] += order
+    atoms = sorted({atom for k in aromatic for atom in bonds[k][:2]})
+    degree = np.zeros(n, dtype=int)
+    for k in aromatic:
+        degree[bonds[k][0]] += 1
+        degree[bonds[k][1]] += 1
+
+    # an atom needs a double bond when its lowest valence is not filled by single bonds
+    valence = np.array([__VALENCES.get(element, (0,))[0] for element in elements])+np.where(np.isin(elements, ['N','O','S','P']), charges, -np.abs(charges))
+    needs = {atom for atom in atoms if saturation[atom]+degree[atom]+hydrogens[atom] < valence[atom] and not any(order == 2 for i, j, order in bonds if atom in (i, j))}
+
+    # augmenting paths (maximum matching) over the aromatic bonds between the atoms that need a double bond
+    partner = {}
+    graph = {atom:[bonds[k][1] if bonds[k][0] == atom else bonds[k][0] for k in aromatic if atom in bonds[k][:2]] for atom in needs}
+    def augment(atom, visited):
+        for other in graph[atom]:
+            if other in needs and other not in visited:
+                visited.add(other)
+                if other not in partner or augment(partner[other], visited):
+                    partner[atom], partner[other] = other, atom
+                    return True
+        return False
+    for atom in sorted(needs, key=lambda atom: len(graph[atom])):
+        if atom not in partner:
+            augment(atom, {atom})
+
+    # each connected aromatic system is kekulized only if all its atoms that need a double bond got one
+    system = {atom:atom for atom in atoms}
+    def root(atom):
+        while system[atom] != atom:
+            atom = system[atom]
+        return atom
+    for k in aromatic:
+        system[root(bonds[k][0])] = root(bonds[k][1])
+    failed = {root(atom) for atom in needs if atom not in partner}
+
+    for k in aromatic:
+        i, j = bonds[k][:2]
+        bonds[k][2] = 2 if partner.get(i) == j and root(i) not in failed else 1
+    fixed = {atom:max(0, valence[atom]-saturation[atom]-degree[atom]-(atom in needs)-hydrogens[atom]) for atom in atoms if root(atom) in failed}
+
+    return [tuple(bond) for bond in bonds], fixed
+
+
+def __hydrogen_directions(center:np.ndarray,neighbors:np.ndarray,count:int,planar:bool,reference:np.ndarray=None):
+    """Place count implicit hydrogens around an atom with the given bonded positions, in a trigonal (planar) or tetrahedral geometry, and return their unit directions."""
+    if count == 0 or len(neighbors) == 0:
+        return []
+    bonds = neighbors-center
+    bonds = bonds/np.linalg.norm(bonds, axis=1)[:, None]
+
+    if len(bonds) >= 3 or (len(bonds) == 2 and planar):
+        direction = -bonds.sum(axis=0)
+        return [direction/np.linalg.norm(direction)]
+
+    if len(bonds) == 2:
+        bisector = bonds.sum(axis=0)/np.linalg.norm(bonds.sum(axis=0))
+        normal = np.cross(bonds[0], bonds[1])/np.linalg.norm(np.cross(bonds[0], bonds[1]))
+        return [-bisector/np.sqrt(3)+sign*normal*np.sqrt(2/3) for sign in (1, -1)][:count]
+
+    axis = bonds[0]
+    # the hydrogens are staggered to a second neighbor, or placed around an arbitrary perpendicular
+    if reference is None or np.linalg.norm(np.cross(reference-center, axis)) < 1e-6:
+        reference = center+(np.array([1.0, 0.0, 0.0]) if abs(axis[0]) < 0.9 else np.array([0.0, 1.0, 0.0]))
+    perpendicular = (reference-center)-np.dot(reference-center, axis)*axis
+    perpendicular = perpendicular/np.linalg.norm(perpendicular)
+    third = np.cross(axis, perpendicular)
+
+    if planar:
+        return [-axis/2+sign*perpendicular*np.sqrt(3)/2 for sign in (-1, 1)][:count]
+    # a single hydrogen (hydroxyls, thiols) is gauche to the second neighbor, two or three are anti first
+    angles = (np.pi/3,) if count == 1 else (np.pi, np.pi/3, -np.pi/3)
+    return [-axis/3+np.sqrt(8)/3*(np.cos(angle)*perpendicular+np.sin(angle)*third) for angle in angles][:count]
+
+
+def __feature_point(name:str,atoms,coords:np.ndarray,vectors:list=None,svector:np.ndarray=None):
+    """Build a pharmacophore point in the PHARMIT JSON format at the centroid of the matched atoms."""
+    x, y, z = coords[list(atoms)].mean(axis=0)
+    point = {'enabled':True, 'name':name, 'radius':__FEATURE_RADII[name], 'size':len(atoms)}
+    if vectors:
+        if svector is None:
+            svector = np.mean(vectors, axis=0)
+        point['svector'] = dict(zip('xyz', map(float, svector)))
+        point['vector'] = [dict(zip('xyz', map(float, vector))) for vector in vectors]
+    point.update(x=float(x), y=float(y), z=float(z))
+    return point
+
+
+def __unique_matches(matches:list,coords:np.ndarray=None,merge_distance:float=None):
+    """Remove the repeated pattern matches (the same atoms matched in another order or by another pattern). With merge_distance, the matches whose centroids are closer than it are merged into one match with all their atoms, as PHARMIT does for the hydrophobic points."""
+    matches = sorted({frozenset(int(atom) for atom in match) for match in matches}, key=min)
+    if merge_distance is None or len(matches) < 2:
+        return matches
+
+    # single linkage of the centroids: connected components of the pairs closer than merge_distance
+    centroids = np.array([coords[list(match)].mean(axis=0) for match in matches])
+    cluster = list(range(len(matches)))
+    def root(k):
+        while cluster[k] != k:
+            k = cluster[k]
+        return k
+    pairs = cKDTree(centroids).query_pairs(merge_distance, output_type='ndarray')
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    for i, j in pairs[np.linalg.norm(centroids[pairs[:, 0]]-centroids[pairs[:, 1]], axis=1) < merge_distance]:
+        cluster[root(i)] = root(j)
+
+    merged = {}
+    for k, match in enumerate(matches):
+        merged[root(k)] = merged.get(root(k), frozenset()) | match
+    return sorted(merged.values(), key=min)
+
+
+def _perceive_molecule(elements:np.ndarray,coords:np.ndarray,charges:np.ndarray,bonds:list):
+    """Perceive the pharmacophore points of a molecule with the PHARMIT feature definitions, using NumPy masks over the atoms and the adjacency matrix. Raises a ValueError for molecules of more than __MAX_PERCEIVED_ATOMS heavy atoms."""
+    # explicit hydrogens are only kept as the directions of the donors
+    heavy = np.flatnonzero(elements != 'H')
+    if len(heavy) > __MAX_PERCEIVED_ATOMS:
+        raise ValueError(f"The molecule has {len(heavy)} heavy atoms, more than the {__MAX_PERCEIVED_ATOMS} of the numpy engine, use engine='pharmit'")
+    position = {atom:k for k, atom in enumerate(heavy)}
+    n = len(heavy)
+    explicit = [[] for k in range(n)]
+    heavy_bonds = []
+    for i, j, order in bonds:
+        if i in position and j in position:
+            heavy_bonds.append((position[i], position[j], order))
+        elif i in position:
+            explicit[position[i]].append(coords[j])
+        elif j in position:
+            explicit[position[j]].append(coords[i])
+
+    elements, coords, charges = elements[heavy], coords[heavy], charges[heavy].astype(int)
+    n_explicit = np.array([len(h) for h in explicit], dtype=int)
+    heavy_bonds, fixed = __kekulize(elements, charges, n_explicit, heavy_bonds)
+
+    # the bond matrices are int8 to keep the dense n x n arrays small
+    order = np.zeros((n, n), dtype=np.int8)
+    for i, j, bond_order in heavy_bonds:
+        order[i, j] = order[j, i] = bond_order
+    adjacency = order > 0
+    A = adjacency.astype(np.int8)
+    degree = A.sum(axis=1)
+
+    # implicit hydrogens fill the lowest valence that is not below the bond orders
+    saturation = order.sum(axis=1)+n_explicit
+    implicit = np.zeros(n, dtype=int)
+    for k, element in enumerate(elements):
+        shift = charges[k] if element in ('N','O','S','P') else -abs(charges[k])
+        valences = [valence+shift for valence in __VALENCES.get(element, (0,)) if valence+shift >= saturation[k]]
+        implicit[k] = fixed.get(k, valences[0]-saturation[k] if valences else 0)
+    hydrogens = implicit+n_explicit
+    connections = degree+hydrogens
+
+    # aromatic rings by the Hückel rule over the kekulized bonds
+    rings = __find_rings(n, [(i, j) for i, j, bond_order in heavy_bonds])
+    in_ring = np.zeros(n, dtype=bool)
+    for ring in rings:
+        in_ring[ring] = True
+
+    aromatic_rings = []
+    for ring in rings:
+        if len(ring) not in (5, 6, 7):
+            continue
+        electrons = 0
+        for atom in ring:
+            double = np.flatnonzero(order[atom] == 2)
+            if len(double) and in_ring[double].any():
+                electrons = electrons+1
+            elif len(double):
+                electrons = None if elements[atom] not in ('C','N','S','P') else electrons
+            elif elements[atom] in ('N','O','S','Se','P') and degree[atom] <= 3 and charges[atom] <= 0:
+                electrons = electrons+2
+            elif elements[atom] == 'C' and charges[atom] < 0:
+                electrons = electrons+2
+            elif elements[atom] == 'C' and charges[atom] > 0:
+                pass
+            else:
+                electrons = None
+            if electrons is None:
+                break
+        if electrons is not None and electrons % 4 == 2:
+            aromatic_rings.append(ring)
+
+    aromatic = np.zeros(n, dtype=bool)
+    aromatic_bond = np.zeros((n, n), dtype=bool)
+    for ring in aromatic_rings:
+        aromatic[ring] = True
+        for k in range(len(ring)):
+            aromatic_bond[ring[k], ring[k-1]] = aromatic_bond[ring[k-1], ring[k]] = True
+    single = (order == 1) & ~aromatic_bond
+    double = (order == 2) & ~aromatic_bond
+
+    carbon = (elements == 'C') & ~aromatic
+    nitrogen, oxygen, sulfur = elements == 'N', elements == 'O', elements == 'S'
+
+    def has_neighbor(mask, bond=adjacency):
+        return (bond & mask[None, :]).any(axis=1)
+
+    planar = aromatic | (order >= 2).any(axis=1) | ((nitrogen & (connections == 3)) & (adjacency & ((order == 2).any(axis=1) | aromatic)[None, :] & np.isin(elements, ['C','N'])[None, :]).any(axis=1)) | ((oxygen | sulfur) & (connections == 2) & has_neighbor(aromatic))
+
+    points = []
+
+    # Aromatic: the centroid of 5- and 6-membered aromatic rings, with the ring normal
+    for ring in aromatic_rings:
+        if len(ring) in (5, 6):
+            centered = coords[ring]-coords[ring].mean(axis=0)
+            normal = np.cross(centered[0], centered[1])
+            normal = normal/np.linalg.norm(normal)
+            points.append(__feature_point('Aromatic', ring, coords, [normal, -normal], normal))
+
+    # HydrogenDonor: N, O and S with hydrogens, except triflamides and acid hydroxyls, pointing to the hydrogens
+    acid_center = np.isin(elements, ['C','S','P']) & ~aromatic & has_neighbor(oxygen, double)
+    trifluoromethyl = carbon & (connections == 4) & ((A & (elements == 'F')[None, :]).sum(axis=1) == 3)
+    sulfonyl = sulfur & (connections == 4) & ((double & oxygen[None, :]).sum(axis=1) == 2) & has_neighbor(trifluoromethyl)
+    donors = (hydrogens > 0) & ((nitrogen & ~has_neighbor(sulfonyl, single)) | (oxygen & ~has_neighbor(acid_center, single)) | sulfur)
+    hydrogen_directions = {}
+    for atom in np.flatnonzero((hydrogens > 0) & (nitrogen | oxygen | sulfur)):
+        neighbors = coords[adjacency[atom]]
+        second = [k for k in np.flatnonzero(adjacency[np.flatnonzero(adjacency[atom])[0]]) if k != atom] if degree[atom] else []
+        directions = [(h-coords[atom])/np.linalg.norm(h-coords[atom]) for h in explicit[atom]]
+        bonded = np.vstack([neighbors]+[explicit[atom]]) if explicit[atom] else neighbors
+        hydrogen_directions[atom] = directions+__hydrogen_directions(coords[atom], bonded, implicit[atom], planar[atom], coords[second[0]] if second else None)
+    for atom in np.flatnonzero(donors):
+        points.append(__feature_point('HydrogenDonor', [atom], coords, hydrogen_directions[atom]))
+
+    # HydrogenAcceptor: N except aromatic NX3, amides, anilines, ammoniums and amidines; O except esters and aromatic ethers
+    amide_like = has_neighbor(has_neighbor(~(elements == 'C'), double), single)
+    amidine_carbon = carbon & ((A @ nitrogen) >= 2) & ((A @ (nitrogen | (elements == 'C'))) >= 3)
+    acceptors = nitrogen & ~(aromatic & (connections == 3)) & ~((connections == 3) & ~aromatic & (amide_like | has_neighbor(aromatic, single))) & ~(connections == 4) & ~has_neighbor(amidine_carbon, double)
+    carbonyl_carbon = carbon & has_neighbor(oxygen, double)
+    acceptors = acceptors | (oxygen & ~aromatic & ~((connections == 2) & has_neighbor(carbonyl_carbon, single) & ((A @ carbon) >= 2)) & ~((A @ aromatic) >= 2))
+    for atom in np.flatnonzero(acceptors):
+        # the acceptor points along its hydrogens (as pharmit does for hydroxyls), otherwise away from its neighbors
+        bonded = coords[adjacency[atom]]
+        if hydrogen_directions.get(atom):
+            direction = np.sum(hydrogen_directions[atom], axis=0)
+        elif len(bonded):
+            direction = -((bonded-coords[atom])/np.linalg.norm(bonded-coords[atom], axis=1)[:, None]).sum(axis=0)
+        else:
+            direction = np.zeros(3)
+        norm = np.linalg.norm(direction)
+        points.append(__feature_point('HydrogenAcceptor', [atom], coords, [direction/norm] if norm > 1e-6 else None))
+
+    # PositiveIon: positive atoms (not next to a negative one), amidines, guanidines and imidazoles
+    matches = [[atom] for atom in np.flatnonzero((charges > 0) & ~has_neighbor(charges < 0))]
+    for atom in np.flatnonzero(carbon & has_neighbor(carbon)):
+        for imine in np.flatnonzero(double[atom] & nitrogen):
+            matches.extend([atom, imine, amine] for amine in np.flatnonzero(single[atom] & nitrogen))
+    matches.extend([atom] for atom in np.flatnonzero(carbon & ((A @ nitrogen) >= 3) & has_neighbor(nitrogen, double)))
+    for ring in aromatic_rings:
+        if len(ring) == 5 and sorted(elements[ring]) == ['C','C','C','N','N'] and sum(hydrogens[atom] for atom in ring if elements[atom] == 'N') == 1:
+            matches.extend([atom] for atom in ring if elements[atom] == 'N' and hydrogens[atom] == 0 and not any(adjacency[atom, other] for other in ring if elements[other] == 'N'))
+    points.extend(__feature_point('PositiveIon', match, coords) for match in __unique_matches(matches))
+
+    # NegativeIon: negative atoms (not next to a positive one), carboxylic, sulfonic, phosphonic and hydroxamic acids and tetrazoles
+    anionic_oxygen = oxygen & ((charges < 0) | (hydrogens == 1) | (connections == 1))
+    matches = [[atom] for atom in np.flatnonzero((charges < 0) & ~has_neighbor(charges > 0))]
+    for atom in np.flatnonzero(carbonyl_carbon):
+        for carbonyl in np.flatnonzero(double[atom] & oxygen):
+            matches.extend([atom, carbonyl, hydroxyl] for hydroxyl in np.flatnonzero(single[atom] & anionic_oxygen))
+            for nitrogen_atom in np.flatnonzero(single[atom] & nitrogen):
+                matches.extend([atom, carbonyl, nitrogen_atom, hydroxyl] for hydroxyl in np.flatnonzero(single[nitrogen_atom] & anionic_oxygen))
+    matches.extend([atom] for atom in np.flatnonzero(np.isin(elements, ['S','P']) & has_neighbor(oxygen, double) & has_neighbor(anionic_oxygen, single)))
+    for ring in aromatic_rings:
+        if len(ring) == 5 and sorted(elements[ring]) == ['C','N','N','N','N'] and any(hydrogens[atom] == 1 for atom in ring if elements[atom] == 'N'):
+            matches.append(ring)
+    points.extend(__feature_point('NegativeIon', match, coords) for match in __unique_matches(matches))
+
+    # Hydrophobic: aromatic and carbocyclic rings, terminal carbons and halogens with their branches and chains, and thioethers
+    terminal = (carbon & (degree == 1) & (hydrogens >= 1)) | np.isin(elements, ['F','Cl','Br','I'])
+    chain = carbon & (degree == 2)
+    n_terminal = A @ terminal
+    matches = [ring for ring in aromatic_rings if len(ring) in (5, 6)]
+    # the terminal atoms two bonds away are the paths of length two, minus the paths back to the atom itself
+    matches.extend([atom] for atom in np.flatnonzero(terminal & ((A @ n_terminal-degree*terminal) == 0)))
+    for atom in np.flatnonzero(n_terminal == 2):
+        matches.append([atom]+list(np.flatnonzero(adjacency[atom] & terminal)))
+    for atom in np.flatnonzero(n_terminal >= 3):
+        for branch in itertools.combinations(np.flatnonzero(adjacency[atom] & terminal), 3):
+            matches.append([atom]+list(branch))
+    matches.extend(ring for ring in rings if 3 <= len(ring) <= 8 and carbon[ring].all())
+    matches.extend([i, j] for i, j in np.argwhere(adjacency & chain[:, None] & terminal[None, :]))
+    anchored = chain & has_neighbor(~chain)
+    for middle in np.flatnonzero(chain):
+        ends = np.flatnonzero(adjacency[middle] & chain)
+        matches.extend([first, middle, last] for first in ends for last in ends if first != last and anchored[first])
+    matches.extend([atom] for atom in np.flatnonzero(sulfur & ~aromatic & (hydrogens == 0) & has_neighbor(elements == 'C') & ~has_neighbor(elements != 'C')))
+    points.extend(__feature_point('Hydrophobic', match, coords) for match in __unique_matches(matches, coords, 2.0))
+
+    return points
+
+
+def _molecule_blocks(text:str,extension:str):
+    """Split the text of an SDF, MOL2 or PDB file into the blocks of its molecules, and return them with the reader of the format."""
+    if extension == '.sdf':
+        blocks, lines = [], []
+        for line in text.splitlines(keepends=True):
+            if line.startswith('$$$$'):
+                blocks.append(''.join(lines))
+                lines = []
+            else:
+                lines.append(line)
+        return [block for block in blocks+[''.join(lines)] if block.strip()], __read_sdf_molecule
+    if extension == '.mol2':
+        return ['@<TRIPOS>MOLECULE'+block for block in text.split('@<TRIPOS>MOLECULE')[1:]], __read_mol2_molecule
+    if extension in ('.pdb', '.ent'):
+        return [block for block in text.split('ENDMDL') if 'ATOM' in block or 'HETATM' in block], __read_pdb_molecule
+    raise ValueError(f"Unsupported molecule format {extension}, use SDF, MOL2 or PDB")
+
+
+def __perceive_file(file_name:str):
+    """Perceive the pharmacophore points of every molecule of an SDF, MOL2 or PDB file with the NumPy engine."""
+    with open(file_name, 'r') as file:
+        blocks, reader = _molecule_blocks(file.read(), os.path.splitext(file_name)[1].lower())
+
+    return [_perceive_molecule(*reader(block)) for block in blocks]
+
+
+''' 
+################### PHARMACOPHORE SETS ###################
+'''
+class PharmacophoreSet:
+    """A compact, array-backed collection of pharmacophore points.
+
+    The points are stored as NumPy arrays instead of the Python objects of the tables returned by parse_json_pharmacophore: float32 coordinates, radii and svectors, integer feature type codes (indices of PharmacophoreSet.feature_types), integer ligand ids (indices of ligands, -1 for none) and a boolean enabled mask. The DataFrame returned by to_frame shares the numeric arrays without copying them, and from_frame reuses the columns of a float32 table (such as one returned by to_frame) without copying them. A PharmacophoreSet is accepted wherever a pharmacophore table is, by compute_concensus_pharmacophore, save_pharmacophore_to_json, save_pharmacophore_to_pymol and show_pharmacophoric_descriptors.
+
+    Args:
+        xyz (np.ndarray): The coordinates of the points, with shape (n, 3).
+        radius (np.ndarray): The radii of the points.
+        types (np.ndarray): The feature type codes of the points.
+        svector (np.ndarray, optional): The svectors of the points, with shape (n, 3) and NaN rows for the points without vector. Defaults to None (no vectors).
+        enabled (np.ndarray, optional): The enabled mask of the points. Defaults to None (all enabled).
+        ligand_ids (np.ndarray, optional): The ligand ids of the points. Defaults to None (no ligands).
+        ligands (list, optional): The ligand names indexed by ligand_ids. Defaults to None (no ligands).
+
+    Example:
+        >>> p4_set = PharmacophoreSet.from_frame(p4_table)
+        >>> p4_set
+        PharmacophoreSet(19 points, 8 ligands)
+        >>> p4_set.xyz.dtype, p4_set.names[:2]
+        (dtype('float32'), array(['HydrogenAcceptor', 'Hydrophobic'], dtype='<U19'))
+        >>> concensus, links = compute_concensus_pharmacophore(p4_set)
+    """
+
+    feature_types = _FEATURE_TYPES
+    feature_colors = tuple(_COLOR_CODE[name] for name in _FEATURE_TYPES)
+    feature_color_codes = _FEATURE_COLORS
+    color_dtype = _COLOR_DTYPE
+
+    def __init__(self, xyz:np.ndarray, radius:np.ndarray, types:np.ndarray, svector:np.ndarray=None, enabled:np.ndarray=None, ligand_ids:np.ndarray=None, ligands:list=None):
+        self.xyz = np.asarray(xyz, dtype=np.float32).reshape(-1, 3)
+        n = len(self.xyz)
+        self.radius = np.asarray(radius, dtype=np.float32)
+        self.types = np.asarray(types, dtype=np.int16)
+        self.svector = np.full((n, 3), np.nan, dtype=np.float32) if svector is None else np.asarray(svector, dtype=np.float32).reshape(-1, 3)
+        self.enabled = np.ones(n, dtype=bool) if enabled is None else np.asarray(enabled, dtype=bool)
+        self.ligand_ids = np.full(n, -1, dtype=np.int32) if ligand_ids is None else np.asarray(ligand_ids, dtype=np.int32)
+        self.ligands = np.asarray([] if ligands is None else ligands, dtype=object)
+
+        for name in ('radius', 'types', 'svector', 'enabled', 'ligand_ids'):
+            if len(getattr(self, name)) != n:
+                raise ValueError(f"{name} has {len(getattr(self, name))} rows, expected {n}")
+        if n and (self.types.min() < 0 or self.types.max() >= len(self.feature_types)):
+            raise ValueError("types must be codes of PharmacophoreSet.feature_types")
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def __getitem__(self, index):
+        """Select points by a boolean mask, an index array or a slice, keeping the ligand names."""
+        return PharmacophoreSet(self.xyz[index], self.radius[index], self.types[index], self.svector[index], self.enabled[index], self.ligand_ids[index], self.ligands)
+
+    def __repr__(self):
+        return f"PharmacophoreSet({len(self)} points, {len(self.ligands)} ligands)"
+
+    @property
+    def names(self):
+        """np.ndarray: The feature names of the points."""
+        return np.asarray(self.feature_types)[self.types]
+
+    @property
+    def has_vector(self):
+        """np.ndarray: A boolean mask of the points with an svector."""
+        return ~np.isnan(self.svector).any(axis=1)
+
+    @classmethod
+    def from_frame(cls, table:pd.DataFrame):
+        """Build a PharmacophoreSet from a pharmacophore table with the columns 'name', 'x', 'y', 'z', 'radius' and optionally 'svector', 'enabled' and 'ligand'.
+
+        Args:
+            table (pd.DataFrame): The pharmacophore table, e.g. returned by parse_json_pharmacophore, load_pharmacophore_directory or to_frame.
+
+        Returns:
+            PharmacophoreSet: The points of the table, in the same order.
+
+        Raises:
+            ValueError: If the table has feature names that are not in PharmacophoreSet.feature_types.
+        """
+        names = table['name'].array if isinstance(table['name'].dtype, pd.CategoricalDtype) and tuple(table['name'].cat.categories) == cls.feature_types else pd.Categorical(table['name'], categories=cls.feature_types)
+        if (names.codes < 0).any():
+            raise ValueError(f"Unknown pharmacophore features: {sorted(set(table['name'][names.codes < 0]))}")
+
+        svector = None
+        if 'sv_x' in table:
+            svector = np.column_stack([table['sv_x'].to_numpy(dtype=np.float32), table['sv_y'].to_numpy(dtype=np.float32), table['sv_z'].to_numpy(dtype=np.float32)])
+        elif 'svector' in table:
+            svector = np.array([(sv['x'], sv['y'], sv['z']) if isinstance(sv, dict) else (np.nan, np.nan, np.nan) for sv in table['svector']], dtype=np.float32).reshape(-1, 3)
+
+        ligand_ids, ligands = None, None
+        if 'ligand' in table:
+            ligand = table['ligand'].astype('category')
+            ligand_ids, ligands = ligand.cat.codes.to_numpy(), list(ligand.cat.categories)
+
+        enabled = table['enabled'].to_numpy(dtype=bool) if 'enabled' in table else None
+
+        x, y, z = (table[column].to_numpy() for column in ('x', 'y', 'z'))
+        step = y.ctypes.data-x.ctypes.data
+        if x.dtype == y.dtype == z.dtype == np.float32 and x.strides == y.strides == z.strides and z.ctypes.data-y.ctypes.data == step and x.base is not None and x.base is y.base is z.base:
+            # the columns are views of one (n, 3) array, as in the tables of to_frame
+            xyz = np.lib.stride_tricks.as_strided(x, shape=(len(x), 3), strides=(x.strides[0], step), writeable=False)
+        else:
+            xyz = table[['x','y','z']].to_numpy(dtype=np.float32)
+
+        return cls(xyz, table['radius'].to_numpy(dtype=np.float32), names.codes, svector, enabled, ligand_ids, ligands)
+
+    @classmethod
+    def from_json(cls, json_file:str):
+        """Build a PharmacophoreSet from a PHARMIT JSON file, see parse_json_pharmacophore."""
+        table, lig, receptor = parse_json_pharmacophore(json_file, lazy=True)
+        table['ligand'] = os.path.splitext(os.path.basename(json_file))[0]
+        return cls.from_frame(table)
+
+    def to_frame(self, vectors:bool=False):
+        """Return the points as a pharmacophore table that shares the coordinate, radius, svector and enabled arrays.
 
-    return table, lig, receptor
+        Args:
+            vectors (bool, optional): A boolean indicating whether to add the 'svector' column of dicts (NaN for the points without vector) used by PHARMIT JSON files. Defaults to False.
+
+        Returns:
+            pd.DataFrame: A DataFrame with the columns 'name' and 'ligand' (categorical), 'x', 'y', 'z', 'radius', 'sv_x', 'sv_y', 'sv_z' (float32), 'has_vector', 'enabled', 'color' (categorical) and optionally 'svector'.
+        """
+        table = pd.DataFrame({'name':pd.Categorical.from_codes(self.types, categories=self.feature_types),
+                              'x':self.xyz[:, 0], 'y':self.xyz[:, 1], 'z':self.xyz[:, 2],
+                              'radius':self.radius,
+                              'sv_x':self.svector[:, 0], 'sv_y':self.svector[:, 1], 'sv_z':self.svector[:, 2],
+                              'has_vector':self.has_vector,
+                              'enabled':self.enabled,
+                              'ligand':pd.Categorical.from_codes(self.ligand_ids, categories=self.ligands)}, copy=False)
+        table['color'] = pd.Categorical.from_codes(self.feature_color_codes[self.types], dtype=self.color_dtype)
+        if vectors:
+            table['svector'] = [{'x':float(x), 'y':float(y), 'z':float(z)} if has else np.nan for (x, y, z), has in zip(self.svector, self.has_vector)]
+
+        return table
+
+
+class PharmacophoreStore:
+    """An append-only, memory-mapped store of pharmacophore points for collections that do not fit in memory.
+
+    The store is a folder with one file of fixed-width records (xyz, radius, feature type code, enabled flag, ligand id and svector, see PharmacophoreStore.record_dtype), the ligand names indexed by the ligand ids, and one file of row numbers per feature type. Reading the records maps the file instead of loading it, and indexing a store (with a slice, a boolean mask, row numbers or a feature name) reads only the selected rows into a PharmacophoreSet. compute_concensus_pharmacophore accepts a store and reads one feature type at a time.
+
+    Args:
+        folder (str): The folder of the store, created if it does not exist.
+
+    Raises:
+        ValueError: If the folder holds a store written with other feature type codes or record layout.
+
+    Example:
+        >>> store = PharmacophoreStore('campaign_points')
+        >>> store.append(load_pharmacophore_directory('campaign/pharmacophores/'))
+        >>> store
+        PharmacophoreStore('campaign_points', 25000000 points, 1000000 ligands)
+        >>> store.counts()
+        {'Aromatic': 4100000, 'HydrogenAcceptor': 8300000, ...}
+        >>> donors = store['HydrogenDonor']
+        >>> show_pharmacophoric_descriptors(store[:5000])
+        >>> concensus, links = compute_concensus_pharmacophore(store, save_data_per_descriptor=False)
+    """
+
+    feature_types = PharmacophoreSet.feature_types
+    record_dtype = np.dtype([('xyz', '<f4', (3,)), ('radius', '<f4'), ('type', '<i2'), ('enabled', '?'), ('ligand', '<i4'), ('svector', '<f4', (3,))], align=True)
+
+    def __init__(self, folder:str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+        header = {'version':1, 'record':self.record_dtype.descr, 'feature_types':list(self.feature_types)}
+        header_file = os.path.join(folder, 'store.json')
+        if os.path.exists(header_file):
+            with open(header_file) as file:
+                stored = json.load(file)
+            if stored != json.loads(json.dumps(header)):
+                raise ValueError(f"{folder} holds a store with another record layout or feature types")
+        else:
+            with open(header_file, 'w') as file:
+                json.dump(header, file)
+
+        self.ligands = []
+        if os.path.exists(os.path.join(folder, 'ligands.txt')):
+            with open(os.path.join(folder, 'ligands.txt')) as file:
+                self.ligands = file.read().splitlines()
+        self._ligand_ids = {ligand:i for i, ligand in enumerate(self.ligands)}
+
+    def __len__(self):
+        path = os.path.join(self.folder, 'points.bin')
+        return os.path.getsize(path)//self.record_dtype.itemsize if os.path.exists(path) else 0
+
+    def __repr__(self):
+        return f"PharmacophoreStore('{self.folder}', {len(self)} points, {len(self.ligands)} ligands)"
+
+    @property
+    def records(self):
+        """np.ndarray: A read-only memory map of all the records."""
+        if len(self) == 0:
+            return np.zeros(0, dtype=self.record_dtype)
+        return np.memmap(os.path.join(self.folder, 'points.bin'), dtype=self.record_dtype, mode='r', shape=(len(self),))
+
+    def rows(self, name:str):
+        """Return the row numbers of the points of a feature type, as a read-only memory map."""
+        path = os.path.join(self.folder, f'type_{self.feature_types.index(name):02d}.idx')
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(path, dtype=np.int64, mode='r')
+
+    def counts(self):
+        """Return the number of points of each feature type in the store, read from the sizes of the index files."""
+        counts = {}
+        for code, name in enumerate(self.feature_types):
+            path = os.path.join(self.folder, f'type_{code:02d}.idx')
+            if os.path.exists(path) and os.path.getsize(path):
+                counts[name] = os.path.getsize(path)//8
+        return counts
+
+    def __getitem__(self, index):
+        """Read the points of a feature type (by name), or the rows selected by a slice, a boolean mask or row numbers, into a PharmacophoreSet."""
+        if isinstance(index, str):
+            index = self.rows(index)
+        records = self.records[index]
+        return PharmacophoreSet(records['xyz'], records['radius'], records['type'], records['svector'], records['enabled'], records['ligand'], self.ligands)
+
+    def iter_chunks(self, chunk_size:int=1000000):
+        """Yield the points of the store in order as PharmacophoreSets of at most chunk_size points."""
+        for start in range(0, len(self), chunk_size):
+            yield self[start:start+chunk_size]
+
+    def _repair(self):
+        """Undo the writes of an interrupted append: truncate the partial ligand name, record and row numbers, and index again the records whose row numbers were not all written."""
+        path = os.path.join(self.folder, 'ligands.txt')
+        if os.path.exists(path):
+            with open(path, 'rb+') as file:
+                data = file.read()
+                if data and not data.endswith(b'\n'):
+                    file.truncate(data.rfind(b'\n')+1)
+            with open(path) as file:
+                self.ligands = file.read().splitlines()
+            self._ligand_ids = {ligand:i for i, ligand in enumerate(self.ligands)}
+
+        path = os.path.join(self.folder, 'points.bin')
+        if os.path.exists(path) and os.path.getsize(path) % self.record_dtype.itemsize:
+            os.truncate(path, len(self)*self.record_dtype.itemsize)
+
+        indices = [os.path.join(self.folder, f'type_{code:02d}.idx') for code in range(len(self.feature_types))]
+        for index in indices:
+            if os.path.exists(index) and os.path.getsize(index) % 8:
+                os.truncate(index, os.path.getsize(index)//8*8)
+
+        n = len(self)
+        if sum(os.path.getsize(index)//8 for index in indices if os.path.exists(index)) == n:
+            return
+
+        # the records of the interrupted append start at the first row missing from the indices
+        indexed = np.zeros(n, dtype=bool)
+        for index in indices:
+            if os.path.exists(index) and os.path.getsize(index):
+                indexed[np.fromfile(index, dtype=np.int64)] = True
+        start = int(np.argmin(indexed)) if not indexed.all() else n
+        for index in indices:
+            if os.path.exists(index) and os.path.getsize(index):
+                rows = np.fromfile(index, dtype=np.int64)
+                os.truncate(index, int(np.searchsorted(rows, start))*8)
+        self._write_indices(np.arange(start, n, dtype=np.int64), self.records['type'][start:n])
+
+    def _write_indices(self, rows:np.ndarray, types:np.ndarray):
+        for code in np.unique(types):
+            with open(os.path.join(self.folder, f'type_{code:02d}.idx'), 'ab') as file:
+                file.write(rows[types == code].tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+
+    def append(self, points):
+        """Append the points of a PharmacophoreSet or a pharmacophore table to the store, registering their ligands, and return the row numbers of the new points.
+
+        The append holds the lock file store.lock, so that appends from other threads or processes wait for each other. The ligand names and the records are written and synced before the row numbers of the feature types, and the writes left by an interrupted append are undone first.
+        """
+        if not isinstance(points, PharmacophoreSet):
+            points = PharmacophoreSet.from_frame(points)
+
+        with _file_lock(os.path.join(self.folder, 'store.lock')):
+            self._repair()
+
+            new_ligands = [ligand for ligand in points.ligands if ligand not in self._ligand_ids]
+            if new_ligands:
+                with open(os.path.join(self.folder, 'ligands.txt'), 'a') as file:
+                    file.writelines(f"{ligand}\n" for ligand in new_ligands)
+                    file.flush()
+                    os.fsync(file.fileno())
+                for ligand in new_ligands:
+                    self._ligand_ids[ligand] = len(self.ligands)
+                    self.ligands.append(ligand)
+            ligand_map = np.array([self._ligand_ids[ligand] for ligand in points.ligands]+[-1], dtype=np.int32)
+
+            records = np.zeros(len(points), dtype=self.record_dtype)
+            records['xyz'], records['radius'], records['type'] = points.xyz, points.radius, points.types
+            records['enabled'], records['svector'] = points.enabled, points.svector
+            records['ligand'] = ligand_map[points.ligand_ids]
+
+            start = len(self)
+            with open(os.path.join(self.folder, 'points.bin'), 'ab') as file:
+                file.write(records.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            rows = np.arange(start, start+len(points), dtype=np.int64)
+            self._write_indices(rows, points.types)
+
+        return rows
+
+
+def __as_table(table, vectors:bool=False):
+    """Return the pharmacophore table of a PharmacophoreSet (or of all the points of a PharmacophoreStore), or the table itself."""
+    if isinstance(table, PharmacophoreStore):
+        table = table[:]
+    return table.to_frame(vectors=vectors) if isinstance(table, PharmacophoreSet) else table
+
+
+def __descriptor_groups(table):
+    """Yield the feature names and the pharmacophore tables of the points of each feature, reading a PharmacophoreStore one feature type at a time."""
+    if isinstance(table, PharmacophoreStore):
+        for name in sorted(table.counts()):
+            yield name, table[name].to_frame()
+        return
+
+    table = __as_table(table)
+    codes, names = __feature_codes(table['name'])
+    for code, group in table.groupby(codes, sort=True):
+        if code >= 0:
+            yield names[code], group
 
 
 def show_pharmacophoric_descriptors(table:pd.DataFrame,selection:str='enabled',show_vectors:bool=True):
@@ -137,7 +1617,7 @@ def show_pharmacophoric_descriptors(table:pd.DataFrame,selection:str='enabled',s
     This function uses the plotly and pandas libraries to create a 3D scatter plot of the pharmacophore points with different colors and sizes based on their names and radii. The function also allows to show or hide the vectors associated with some of the points.
 
     Args:
-        table (pd.DataFrame): A DataFrame with the columns 'name', 'center', 'radius', 'color', 'enabled', and 'svector' for each pharmacophore point.
+        table (pd.DataFrame or PharmacophoreSet): A DataFrame with the columns 'name', 'center', 'radius', 'color', 'enabled', and 'sv_x', 'sv_y', 'sv_z' and 'has_vector' (or 'svector') for each pharmacophore point, or a PharmacophoreSet.
         selection (str, optional): A string indicating which points to show in the plot. It can be 'enabled', 'disabled', or 'all'. Defaults to 'enabled'.
         show_vectors (bool, optional): A boolean indicating whether to show the vectors or not. Defaults to True.
 
@@ -149,6 +1629,9 @@ def show_pharmacophoric_descriptors(table:pd.DataFrame,selection:str='enabled',s
         >>> show_pharmacophoric_descriptors(table, selection='all', show_vectors=False)
         # A 3D scatter plot of all the pharmacophore points without vectors is shown.
     """
+    table=__as_table(table)
+    if 'has_vector' not in table:
+        table=_flatten_svectors(table.copy())
     
     if selection=='enabled':
         table=table[table.enabled==True]
@@ -159,7 +1642,7 @@ def show_pharmacophoric_descriptors(table:pd.DataFrame,selection:str='enabled',s
         
     
     fig=go.Figure()
-    sca = px.scatter_3d(table, x='x', y='y', z='z', size='radius',color='name',color_discrete_map=table.set_index("name")[["color"]].to_dict()['color'],hover_name='ligand')
+    sca = px.scatter_3d(table, x='x', y='y', z='z', size='radius',color='name',color_discrete_map=dict(table[['name','color']].drop_duplicates('name').itertuples(index=False)),hover_name='ligand')
 
     sca.update_traces(marker=dict(size=12,
                                   line=dict(width=2,
@@ -171,19 +1654,17 @@ def show_pharmacophoric_descriptors(table:pd.DataFrame,selection:str='enabled',s
         fig.add_trace(plot)
 
     if show_vectors==True:
-        u=[sv['x'] for sv in table.svector if isinstance(sv,dict)]
-        v=[sv['y'] for sv in table.svector if isinstance(sv,dict)]
-        w=[sv['z'] for sv in table.svector if isinstance(sv,dict)]
+        oriented=table[table.has_vector.to_numpy()]
         
         cl='black'
         
         vectors = go.Figure(data = go.Cone(
-            x=table.dropna(subset=['svector'])['x'],
-            y=table.dropna(subset=['svector'])['y'],
-            z=table.dropna(subset=['svector'])['z'],
-            u=u,
-            v=v,
-            w=w,
+            x=oriented['x'],
+            y=oriented['y'],
+            z=oriented['z'],
+            u=oriented['sv_x'],
+            v=oriented['sv_y'],
+            w=oriented['sv_z'],
             lighting_roughness=1,
             showlegend=False,
             showscale=False,
@@ -202,14 +1683,13 @@ def show_pharmacophoric_descriptors(table:pd.DataFrame,selection:str='enabled',s
     return fig.show()
 
 
-
 def save_pharmacophore_to_pymol (table:pd.DataFrame,out_file:str='pharmacophore.pse',select:str='all'):
     """Save a pharmacophore model to a PyMOL session file.
 
     This function uses the PyMOL command line interface to create pseudoatoms for each pharmacophore point and save them to a PyMOL session file. The function also allows to group the points by cluster, concensus, or name.
 
     Args:
-        table (pd.DataFrame): A DataFrame with the columns 'name', 'center', 'radius', 'color', 'cluster', 'weight', 'balance', and 'svector' for each pharmacophore point.
+        table (pd.DataFrame or PharmacophoreSet): A DataFrame with the columns 'name', 'center', 'radius', 'color', 'cluster', 'weight', 'balance', and 'svector' for each pharmacophore point, or a PharmacophoreSet.
         out_file (str, optional): The file name of the PyMOL session file to be written. Defaults to 'pharmacophore.pse'.
         select (str, optional): A string indicating how to group the points in PyMOL. It can be 'concensus' or 'all'. Defaults to 'all'.
 
@@ -221,6 +1701,7 @@ def save_pharmacophore_to_pymol (table:pd.DataFrame,out_file:str='pharmacophore.
         >>> save_pharmacophore_to_pymol(table, out_file='pharmacophore.pse', select='cluster')
         # A PyMOL session file with the pharmacophore points grouped by cluster is written.
     """
+    table=__as_table(table)
     if select=='concensus':
         for point in table.index:
             cmd.pseudoatom(object=table.loc[point,'name'],resn=table.loc[point,'name'],
@@ -253,7 +1734,7 @@ def save_pharmacophore_to_json (table:pd.DataFrame,out_file:str='pharmacophore.j
     This function converts a pandas DataFrame containing the pharmacophore points to a JSON format and writes it to a file. The JSON format is compatible with the PHARMIT tool for pharmacophore-based virtual screening.
 
     Args:
-        table (pd.DataFrame): A DataFrame with the columns 'name', 'center', 'radius', and optionally 'color', 'cluster', 'weight', 'balance', and 'svector' for each pharmacophore point.
+        table (pd.DataFrame or PharmacophoreSet): A DataFrame with the columns 'name', 'center', 'radius', and optionally 'color', 'cluster', 'weight', 'balance', and 'svector' for each pharmacophore point, or a PharmacophoreSet.
         out_file (str, optional): The file name of the JSON file to be written. Defaults to 'pharmacophore.json'.
 
     Returns:
@@ -264,6 +1745,7 @@ def save_pharmacophore_to_json (table:pd.DataFrame,out_file:str='pharmacophore.j
         >>> save_pharmacophore_to_json(table, out_file='pharmacophore_new.json')
         # A JSON file with the pharmacophore points is written.
     """
+    table=__as_table(table,vectors=True).drop(columns=['sv_x','sv_y','sv_z','has_vector'],errors='ignore')
     
     data=f'"points":{table.to_json(orient="records")}'
     data="{"+data+"}"
@@ -272,27 +1754,40 @@ def save_pharmacophore_to_json (table:pd.DataFrame,out_file:str='pharmacophore.j
         f.write(data)
         
 
-def compute_concensus_pharmacophore (table:pd.DataFrame, save_data_per_descriptor:bool=True, out_folder:str='.', h_dist:float=0.17):
+def compute_concensus_pharmacophore (table:pd.DataFrame, save_data_per_descriptor:bool=True, out_folder:str='.', h_dist:float=0.17, cluster_space:str='profile', weight_cutoff:float=1.5, graph_cutoff:float=1.5, voxel_size:float=None):
     """
     Computes the concensus pharmacophore from a table of 3D coordinates and features of molecular descriptors.
 
     Parameters
     ----------
-    table : pd.DataFrame, optional
-        A pandas dataframe containing the name, x, y, z, color and cluster columns of the molecular descriptors. 
+    table : pd.DataFrame, PharmacophoreSet or PharmacophoreStore
+        A pandas dataframe containing the name, x, y, z, color and cluster columns of the molecular descriptors, a PharmacophoreSet, or a PharmacophoreStore (read one descriptor at a time). 
     save_data_per_descriptor : bool, optional
         A flag indicating whether to save the data and plots for each descriptor cluster or not. The default is True.
     out_folder : str, optional
         The output folder where the data and plots will be saved. The default is '.'.
     h_dist : float, optional
-        The distance threshold for hierarchical clustering. The default is 0.17.
+        The distance threshold for hierarchical clustering, as a fraction of the largest clustered distance. The default is 0.17.
+    cluster_space : str, optional
+        The space where the points are clustered. 'profile' clusters the rows of the n x n distance matrix (the distance profiles of the points, O(n^3) time and two n x n buffers), as in the previous versions. 'xyz' clusters the 3D positions directly from their condensed distance matrix, which is much faster and lighter for thousands of points. 'graph' clusters the 3D positions by single linkage on the sparse graph of the pairs closer than graph_cutoff (the connected components of the graph), with memory proportional to the number of pairs, for 100k points and more; no linkage matrix is computed. The default is 'profile'.
+    weight_cutoff : float, optional
+        The distance in Å within which the neighbors of a point (itself included) are counted in its weight, using a KD-tree of the positions. The default is 1.5.
+    graph_cutoff : float, optional
+        The distance in Å below which two points are linked with cluster_space='graph'. Points connected by a chain of such links fall in the same cluster. The default is 1.5.
+    voxel_size : float, optional
+        The edge in Å of a grid where the points of each descriptor are merged before clustering. The points in the same voxel are replaced by one representative at their mean position, which counts as all of them in the weight, balance and center of the clusters, so only the occupied voxels are clustered. The default is None (no grid).
 
     Returns
     -------
     Concensus : pd.DataFrame
         A pandas dataframe containing the name, cluster, x, y, z, radius, color, weight and balance columns of the concensus pharmacophore.
     Links : dict
-        A dictionary containing the distance matrix and linkage matrix for each descriptor cluster.
+        A dictionary containing the distance matrix (in condensed form with cluster_space='xyz', see scipy.spatial.distance.squareform, and as a sparse matrix of the linked pairs with cluster_space='graph') and linkage matrix (None with cluster_space='graph') for each descriptor cluster.
+
+    Raises
+    ------
+    ValueError
+        If cluster_space is not 'profile', 'xyz' or 'graph', or voxel_size is not positive.
     
     Example
     -------
@@ -304,9 +1799,90 @@ def compute_concensus_pharmacophore (table:pd.DataFrame, save_data_per_descripto
     2   Donor_Acceptor        1 -0.063333 -0.063333 -0.063333     0.5      2       3  0.333333
     """
     
+    if cluster_space not in ('profile','xyz','graph'):
+        raise ValueError(f"Unknown cluster_space {cluster_space}, use 'profile', 'xyz' or 'graph'")
+    if voxel_size is not None and voxel_size <= 0:
+        raise ValueError(f"voxel_size must be positive, got {voxel_size}")
+
+    def __aggregate_voxels(table:pd.DataFrame):
+        # one representative per occupied voxel, at the mean position of its points, with the number of points in members
+        xyz = table[['x','y','z']].to_numpy(dtype=float)
+        voxels = np.floor(xyz/voxel_size).astype(np.int64)
+        voxels, first, inverse, members = np.unique(voxels, axis=0, return_index=True, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        center = np.stack([np.bincount(inverse, weights=xyz[:,i], minlength=len(members)) for i in range(3)], axis=1)/members[:,None]
+
+        representatives = table[['name','radius','color']].iloc[first].reset_index(drop=True)
+        representatives.insert(1, 'x', center[:,0])
+        representatives.insert(2, 'y', center[:,1])
+        representatives.insert(3, 'z', center[:,2])
+        representatives['members'] = members
+        return representatives
+
+    def __members(table:pd.DataFrame):
+        return table['members'].to_numpy() if 'members' in table else np.ones(len(table.index), dtype=np.int64)
+
+    def __count_neighbors(table:pd.DataFrame):
+        # the points within weight_cutoff of every point (itself included), without the n x n distance matrix
+        xyz=table[['x','y','z']].to_numpy(dtype=float)
+        tree=cKDTree(xyz)
+        if 'members' not in table:
+            return tree.query_ball_point(xyz, r=weight_cutoff, return_length=True)
+
+        # a voxel representative counts all the points it stands for
+        pairs=tree.sparse_distance_matrix(tree, max_distance=weight_cutoff, output_type='ndarray')
+        return np.bincount(pairs['i'], weights=__members(table)[pairs['j']], minlength=len(xyz)).astype(np.int64)
+
     def __compute_cluster(table:pd.DataFrame):
         
-        if len(table.index)>2:
+        if len(table.index)<=2 and __members(table).sum()>2:
+
+            # all the points fall in one or two voxels, and each one is a cluster as the linkage would give
+            table['cluster']=np.arange(1,len(table.index)+1)
+
+            weight=__count_neighbors(table)
+
+            table['weight']=weight
+
+            table['balance']=normalize([weight*__members(table)], norm="l1")[0]
+            return None,None,table
+
+        elif len(table.index)>2 and cluster_space=='graph':
+
+            # single linkage cut at graph_cutoff: the clusters are the connected components of the graph of the close pairs
+            xyz = table[['x','y','z']].to_numpy(dtype=float)
+            tree = cKDTree(xyz)
+            pairs = tree.sparse_distance_matrix(tree, max_distance=graph_cutoff, output_type='ndarray')
+            n = len(table.index)
+            graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs['i'], pairs['j'])), shape=(n,n))
+            n_clusters, clusters = connected_components(graph, directed=False)
+            matrix = coo_matrix((pairs['v'], (pairs['i'], pairs['j'])), shape=(n,n)).tocsr()
+
+            table['cluster']=clusters+1
+
+            weight=__count_neighbors(table)
+
+            table['weight']=weight
+
+            table['balance']=normalize([weight*__members(table)], norm="l1")[0]
+            return None,matrix,table
+
+        elif len(table.index)>2 and cluster_space=='xyz':
+
+            matrix = sch.distance.pdist(table[['x','y','z']].to_numpy(dtype=float))
+            linkage = sch.linkage(matrix, method='complete')
+            clusters = sch.fcluster(linkage, h_dist*matrix.max(), 'distance')
+
+            table['cluster']=clusters
+
+            weight=__count_neighbors(table)
+
+            table['weight']=weight
+
+            table['balance']=normalize([weight*__members(table)], norm="l1")[0]
+            return linkage,matrix,table
+
+        elif len(table.index)>2:
             
             matrix=distance_matrix(x=table[['x','y','z']],y=table[['x','y','z']])
             dm = sch.distance.pdist(matrix)
@@ -315,22 +1891,20 @@ def compute_concensus_pharmacophore (table:pd.DataFrame, save_data_per_descripto
 
             table['cluster']=clusters
 
-            
-            weight=[]
-            for row in matrix:
-                weight.append(len([distance for distance in row if distance <= 1.5]))
+            weight=__count_neighbors(table)
 
             table['weight']=weight
 
-            table['balance']=normalize([weight], norm="l1")[0]
+            table['balance']=normalize([weight*__members(table)], norm="l1")[0]
             return linkage,matrix,table
         else:
             return None,None,None
         
     def __compute_center_of_mass_and_radius(table:pd.DataFrame):
 
-        center_of_mass = np.average([table['x'],table['y'],table['z']], axis=1, weights=table['weight'])
-        radius = max([np.linalg.norm(center_of_mass - np.array((table.loc[i,'x'],table.loc[i,'y'],table.loc[i,'z']))) for i in table.index])/2
+        xyz = table[['x','y','z']].to_numpy(dtype=float)
+        center_of_mass = np.average(xyz, axis=0, weights=table['weight']*__members(table))
+        radius = np.linalg.norm(xyz - center_of_mass, axis=1).max()/2
 
         if radius<1 and 'Hydrophobic' in list(table.name):
             radius=1
@@ -358,13 +1932,13 @@ def compute_concensus_pharmacophore (table:pd.DataFrame, save_data_per_descripto
         cmd.remove('all')
         cmd.reinitialize(what='everything')
         
-    Concensus=pd.DataFrame()
+    Concensus=[]
     Links={}
-    Descriptors=table.groupby('name')
-    index=1
-    for group in Descriptors.groups:
-        linkage,matrix,descriptor_cluster=__compute_cluster(Descriptors.get_group(group))
-        if linkage is None:
+    for group,descriptor in __descriptor_groups(table):
+        if voxel_size is not None:
+            descriptor=__aggregate_voxels(descriptor)
+        linkage,matrix,descriptor_cluster=__compute_cluster(descriptor)
+        if descriptor_cluster is None:
             pass
         else:
             Links[group]={'matrix':matrix,'linkage':linkage,'table':descriptor_cluster}
@@ -379,35 +1953,32 @@ def compute_concensus_pharmacophore (table:pd.DataFrame, save_data_per_descripto
                 
                 
 
-                ax=sns.clustermap (matrix,method='complete',figsize=(6,6),xticklabels=0, yticklabels=0,
-                                cmap='binary_r',cbar_kws=dict(label='Distance',shrink=1,orientation='vertical',spacing='uniform',pad=0.02),
-                                row_linkage=linkage, col_linkage=linkage, rasterized=True,row_colors=row_colors,tree_kws=dict(linewidths=1))
-                
-                x0, _y0, _w, _h = ax.cbar_pos
-                ax.ax_cbar.set_position([0.1, 0.8, _w/1, _h/1.2])
-                ax.ax_cbar.set_ylabel('Distance Å',fontsize=10,fontweight='bold')
-                ax.ax_cbar.tick_params(axis='y', length=3,width=1,labelsize=10)
-                
-                ax.savefig(f"{out_folder}/{group}_clusters.svg",dpi=300,bbox_inches="tight")
+                if linkage is not None:
+                    ax=sns.clustermap (sch.distance.squareform(matrix) if matrix.ndim==1 else matrix,method='complete',figsize=(6,6),xticklabels=0, yticklabels=0,
+                                    cmap='binary_r',cbar_kws=dict(label='Distance',shrink=1,orientation='vertical',spacing='uniform',pad=0.02),
+                                    row_linkage=linkage, col_linkage=linkage, rasterized=True,row_colors=row_colors,tree_kws=dict(linewidths=1))
+                    
+                    x0, _y0, _w, _h = ax.cbar_pos
+                    ax.ax_cbar.set_position([0.1, 0.8, _w/1, _h/1.2])
+                    ax.ax_cbar.set_ylabel('Distance Å',fontsize=10,fontweight='bold')
+                    ax.ax_cbar.tick_params(axis='y', length=3,width=1,labelsize=10)
+                    
+                    ax.savefig(f"{out_folder}/{group}_clusters.svg",dpi=300,bbox_inches="tight")
                 
                 __save_pymol_cluster(table=descriptor_cluster,out_file=f"{out_folder}/{group}_clusters.pse",cluster_color_map=lut)
                 
             else:
                 pass
             
-            clusters=descriptor_cluster.groupby('cluster')
-            for cg in clusters.groups:
-                clus=clusters.get_group(cg)
+            # the rows are collected and the table is built once, since growing it with .loc is quadratic in the number of clusters
+            for cg,clus in descriptor_cluster.groupby('cluster'):
                 center_of_mass,radius=__compute_center_of_mass_and_radius(clus)
-                Concensus.loc[index,'name']=group
-                Concensus.loc[index,'cluster']=cg
-                Concensus.loc[index,'x']=center_of_mass[0]
-                Concensus.loc[index,'y']=center_of_mass[1]
-                Concensus.loc[index,'z']=center_of_mass[2]
-                Concensus.loc[index,'radius']=radius
-                Concensus.loc[index,'color']=clus.loc[clus.index[0],'color']
-                Concensus.loc[index,'weight']=int(len(clus.index))
-                Concensus.loc[index,'balance']=clus['balance'].sum()
-                index=index+1
+                Concensus.append({'name':group,'cluster':cg,'x':center_of_mass[0],'y':center_of_mass[1],'z':center_of_mass[2],
+                                  'radius':radius,'color':clus['color'].iloc[0],'weight':__members(clus).sum(),'balance':clus['balance'].sum()})
+
+    if Concensus:
+        Concensus=pd.DataFrame(Concensus, index=range(1,len(Concensus)+1)).astype({'cluster':float,'weight':float})
+    else:
+        Concensus=pd.DataFrame()
     
     return Concensus, Links
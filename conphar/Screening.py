@@ -0,0 +1,165 @@
+__version__ = "0.1.0"
+__author__  = "https://github.com/AngelRuizMoreno"
+
+import os, tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from ._pharmit import _run_pharmit
+from ._readers import _iter_molecules
+from .Pharmacophores import save_pharmacophore_to_json
+
+__all__=['create_pharmacophore_database','search_pharmacophore_database']
+
+
+def create_pharmacophore_database(library:str, dbdir:str, n_shards:int=None, n_workers:int=None, block_size:int=100, timeout:float=None, memory_limit:int=None, cpu_limit:int=None, verbose:bool=True):
+    """Build a PHARMIT screening database from a compound library, split into shards built in parallel.
+
+    This function reads the library lazily and deals it out to n_shards shard files in blocks of block_size molecules, so that the shards have a similar size without counting the library first. Consecutive conformers of a molecule (records with the same name) are kept in the same shard when possible. Then one PHARMIT dbcreate process per shard builds the databases on a bounded pool of workers.
+
+    Args:
+        library (str): The file name of the compound library in SDF or MOL2 format, with 3D conformers.
+        dbdir (str): The folder where the shard databases are created, as the subfolders shard_000, shard_001, etc. The subfolders must not exist.
+        n_shards (int, optional): The number of shards. Defaults to the number of CPUs of the machine.
+        n_workers (int, optional): The maximum number of PHARMIT processes running at the same time. Defaults to the number of CPUs of the machine.
+        block_size (int, optional): The number of consecutive molecules written to a shard before moving to the next one. Defaults to 100.
+        timeout (float, optional): The wall-clock time limit of each PHARMIT process in seconds. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of each PHARMIT process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of each PHARMIT process in seconds. Defaults to None (no limit).
+        verbose (bool, optional): A boolean indicating whether to print the progress of each shard. Defaults to True.
+
+    Returns:
+        list: The folders of the shard databases, to be passed to search_pharmacophore_database.
+
+    Example:
+        >>> shards = create_pharmacophore_database('library.sdf', 'library_db', n_shards=16)
+        >>> shards[:2]
+        ['library_db/shard_000', 'library_db/shard_001']
+    """
+    if n_shards is None:
+        n_shards = os.cpu_count() or 1
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    os.makedirs(dbdir, exist_ok=True)
+    extension = os.path.splitext(library)[1].lower()
+
+    with tempfile.TemporaryDirectory(dir=dbdir) as folder:
+        inputs = [os.path.join(folder, f'shard_{i:03d}{extension}') for i in range(n_shards)]
+        handles = [open(file_name, 'w') for file_name in inputs]
+        try:
+            shard, count, previous = 0, 0, None
+            for name, text in _iter_molecules(library):
+                # a block may grow past block_size to keep conformers together, but not without limit (e.g. untitled molecules)
+                if count >= block_size and (name != previous or count >= 2*block_size):
+                    shard, count = (shard+1) % n_shards, 0
+                handles[shard].write(text)
+                count, previous = count+1, name
+        finally:
+            for handle in handles:
+                handle.close()
+
+        shards = {os.path.join(dbdir, f'shard_{i:03d}'):inputs[i] for i in range(n_shards) if os.path.getsize(inputs[i]) > 0}
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(_run_pharmit, ("-cmd", "dbcreate", "-dbdir", shard, "-in", shard_input), timeout, memory_limit, cpu_limit):shard for shard, shard_input in shards.items()}
+            for future in as_completed(futures):
+                returncode, output = future.result()
+                if returncode != 0:
+                    raise RuntimeError(f"PHARMIT dbcreate failed with exit code {returncode} for {futures[future]}")
+                if verbose:
+                    print(f"{futures[future]}: created")
+
+    return sorted(shards)
+
+
+def __parse_hits(hits_file:str):
+    """Read the molecules and the SD properties (such as rmsd) of a PHARMIT search output in SDF format."""
+    records = []
+    for name, text in _iter_molecules(hits_file):
+        record = {'name':name}
+        lines = text.splitlines()
+        for i, line in enumerate(lines):
+            if line.startswith('>') and '<' in line and i+1 < len(lines):
+                start = line.index('<')+1
+                record[line[start:line.index('>', start)]] = lines[i+1].strip()
+        record['molblock'] = text
+        records.append(record)
+
+    return records
+
+
+def search_pharmacophore_database(query, dbdirs, out:str=None, max_hits:int=None, max_rmsd:float=None, n_workers:int=None, timeout:float=None, memory_limit:int=None, cpu_limit:int=None, verbose:bool=True):
+    """Screen sharded PHARMIT databases with a pharmacophore query and merge the hits.
+
+    This function runs one PHARMIT dbsearch process per shard database on a bounded pool of workers and merges the hits of all shards into one table ranked by RMSD. The query can be a consensus pharmacophore computed with compute_concensus_pharmacophore or any pharmacophore file accepted by PHARMIT.
+
+    Args:
+        query (str or pd.DataFrame): The file name of the pharmacophore query (e.g. JSON), or a DataFrame of pharmacophore points with the columns 'name', 'x', 'y', 'z' and 'radius'.
+        dbdirs (str or list): The folder of a database, or the list of shard folders returned by create_pharmacophore_database.
+        out (str, optional): The base name of an SDF file where the ranked hits are written. Defaults to None.
+        max_hits (int, optional): The maximum number of hits returned by each shard and in the merged table. Defaults to None (no limit).
+        max_rmsd (float, optional): The maximum RMSD of a hit to the query. Defaults to None (the maximum allowed by the query).
+        n_workers (int, optional): The maximum number of PHARMIT processes running at the same time. Defaults to the number of CPUs of the machine.
+        timeout (float, optional): The wall-clock time limit of each PHARMIT process in seconds. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of each PHARMIT process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of each PHARMIT process in seconds. Defaults to None (no limit).
+        verbose (bool, optional): A boolean indicating whether to print the number of hits of each shard. Defaults to True.
+
+    Returns:
+        pd.DataFrame: A DataFrame with one row per hit, sorted by RMSD, with the columns 'name', 'rmsd', the other SD properties written by PHARMIT, 'shard' and 'molblock' (the aligned hit in SDF format).
+
+    Example:
+        >>> concensus, links = compute_concensus_pharmacophore(p4_table)
+        >>> hits = search_pharmacophore_database(concensus, shards, out='hits', max_hits=1000)
+        >>> hits[['name','rmsd','shard']].head()
+    """
+    if isinstance(dbdirs, str):
+        dbdirs = [dbdirs]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    options = ()
+    if max_hits is not None:
+        options = options + ("-max-hits", str(max_hits))
+    if max_rmsd is not None:
+        options = options + ("-max-rmsd", str(max_rmsd))
+
+    records = []
+    with tempfile.TemporaryDirectory() as folder:
+        if isinstance(query, pd.DataFrame):
+            save_pharmacophore_to_json(query, out_file=os.path.join(folder, 'query.json'))
+            query = os.path.join(folder, 'query.json')
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {}
+            for i, dbdir in enumerate(dbdirs):
+                hits_file = os.path.join(folder, f'hits_{i}.sdf')
+                futures[executor.submit(_run_pharmit, ("-cmd", "dbsearch", "-dbdir", dbdir, "-in", query, "-out", hits_file)+options, timeout, memory_limit, cpu_limit)] = (dbdir, hits_file)
+
+            for future in as_completed(futures):
+                dbdir, hits_file = futures[future]
+                returncode, output = future.result()
+                if returncode != 0:
+                    raise RuntimeError(f"PHARMIT dbsearch failed with exit code {returncode} for {dbdir}")
+
+                hits = __parse_hits(hits_file) if os.path.exists(hits_file) else []
+                for hit in hits:
+                    hit['shard'] = dbdir
+                records.extend(hits)
+                if verbose:
+                    print(f"{dbdir}: {len(hits)} hits")
+
+    hits = pd.DataFrame(records, columns=['name','rmsd','shard','molblock'] if not records else None)
+    hits['rmsd'] = pd.to_numeric(hits['rmsd'])
+    hits = hits[['name','rmsd']+[column for column in hits.columns if column not in ('name','rmsd','shard','molblock')]+['shard','molblock']]
+    hits = hits.sort_values('rmsd', kind='stable', ignore_index=True)
+    if max_hits is not None:
+        hits = hits.head(max_hits)
+
+    if out is not None:
+        with open(f'{out}.sdf', 'w') as file:
+            file.writelines(hits['molblock'])
+
+    return hits
@@ -8,5 +8,7 @@ __author__  = "https://github.com/AngelRuizMoreno"
 
 from .Structures import *
 from .Pharmacophores import *
+from .Campaigns import *
+from .Screening import *
 
 print("ConPhar tools imported successfully")
\ No newline at end of file
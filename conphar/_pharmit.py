@@ -0,0 +1,349 @@
+__version__ = "0.1.0"
+__author__  = "https://github.com/AngelRuizMoreno"
+
+''' 
+################### PHARMIT EXECUTABLE ###################
+'''
+from importlib_resources import files
+
+_PHARMIT      = files("conphar.bin").joinpath("pharmitserver")
+_PHARMIT_LIC  = files("conphar.bin").joinpath("README")
+
+
+import os, subprocess, hashlib, shutil, threading, tempfile, asyncio, weakref, resource, time, selectors
+from functools import lru_cache
+
+# One semaphore per event loop, limiting the concurrent asynchronous PHARMIT processes
+_SEMAPHORES = weakref.WeakKeyDictionary()
+# Record lists of the active record_pharmit_usage blocks
+_USAGE      = []
+_USAGE_LOCK = threading.Lock()
+# Seconds between the samples of the peak memory of a running PHARMIT process
+_SAMPLE_INTERVAL = 0.5
+
+
+def _limit_resources(pid:int,memory_limit:int=None,cpu_limit:int=None):
+    """Set the address space (bytes) and CPU time (seconds) limits of a running PHARMIT process."""
+    try:
+        if memory_limit is not None:
+            resource.prlimit(pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+        if cpu_limit is not None:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+    except ProcessLookupError:
+        pass
+
+
+def _peak_memory(pid:int):
+    """Read the peak resident memory (VmHWM) of a running process in bytes, or None if it is not available."""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _record_usage(args:tuple,started:float,wall_time:float,returncode:int,timed_out:bool,usage=None,peak:int=None):
+    """Add the resource usage of a finished PHARMIT process to the active usage records, see record_pharmit_usage."""
+    if not _USAGE:
+        return
+
+    options = dict(zip(args[::2], args[1::2]))
+    record = {'cmd':options.get('-cmd'),
+              'receptor':options.get('-receptor'),
+              'ligand':options.get('-in'),
+              'out':options.get('-out'),
+              'receptor_size':os.path.getsize(options['-receptor']) if os.path.exists(options.get('-receptor') or '') else None,
+              'ligand_size':os.path.getsize(options['-in']) if os.path.exists(options.get('-in') or '') else None,
+              'started':started,
+              'wall_time':wall_time,
+              'user_time':usage.ru_utime if usage is not None else None,
+              'system_time':usage.ru_stime if usage is not None else None,
+              'max_rss':peak,
+              'returncode':returncode,
+              'timed_out':timed_out}
+
+    with _USAGE_LOCK:
+        for records in _USAGE:
+            records.append(record)
+
+
+def _run_pharmit(args:tuple,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,capture_stderr:bool=False):
+    """Run the bundled PHARMIT executable and wait for it to finish.
+
+    Args:
+        args (tuple): The command line arguments passed to PHARMIT.
+        timeout (float, optional): The wall-clock time limit in seconds. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of the process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of the process in seconds. Defaults to None (no limit).
+        capture_stderr (bool, optional): A boolean indicating whether to read the standard error of the process instead of letting it through. Defaults to False.
+
+    Returns:
+        tuple: The exit code of the process and the bytes written to its standard output, and to its standard error with capture_stderr.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout. The process is killed first.
+    """
+    started, start = time.time(), time.perf_counter()
+    popen = subprocess.Popen((_PHARMIT,)+tuple(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE if capture_stderr else None)
+    _limit_resources(popen.pid, memory_limit, cpu_limit)
+
+    # the output is read as it comes, waking up at least every _SAMPLE_INTERVAL seconds to enforce the timeout and to sample
+    # the peak memory of PHARMIT itself, since the ru_maxrss given by wait4 also counts the memory of this process at the time of the fork.
+    # VmHWM is a high-water mark, so sampling it sparsely (and once more at the end of the output) is enough
+    chunks, errors, peak, expired, sampled = [], [], None, False, None
+    selector = selectors.DefaultSelector()
+    selector.register(popen.stdout, selectors.EVENT_READ, chunks)
+    if capture_stderr:
+        selector.register(popen.stderr, selectors.EVENT_READ, errors)
+    try:
+        while selector.get_map():
+            elapsed = time.perf_counter()-start
+            wait = _SAMPLE_INTERVAL if timeout is None or expired else min(_SAMPLE_INTERVAL, max(timeout-elapsed, 0))
+            closed = False
+            for key, _ in selector.select(wait):
+                chunk = os.read(key.fd, 1<<16)
+                if chunk:
+                    key.data.append(chunk)
+                else:
+                    selector.unregister(key.fileobj)
+                    closed = True
+            if sampled is None or time.perf_counter()-sampled >= _SAMPLE_INTERVAL or closed:
+                sample, sampled = _peak_memory(popen.pid), time.perf_counter()
+                if sample is not None:
+                    peak = max(peak or 0, sample)
+            if timeout is not None and not expired and time.perf_counter()-start > timeout:
+                popen.kill()
+                expired = True
+        popen.stdout.close()
+        if capture_stderr:
+            popen.stderr.close()
+        _, status, usage = os.wait4(popen.pid, 0)
+    except BaseException:
+        popen.kill()
+        popen.wait()
+        raise
+    finally:
+        selector.close()
+    popen.returncode = os.waitstatus_to_exitcode(status)
+    output = b''.join(chunks)
+
+    _record_usage(args, started, time.perf_counter()-start, popen.returncode, expired, usage, peak)
+    if expired:
+        raise subprocess.TimeoutExpired(popen.args, timeout, output=output)
+    if capture_stderr:
+        return popen.returncode, output, b''.join(errors)
+    return popen.returncode, output
+
+
+def _file_digest(file_name:str,digest):
+    with open(file_name,'rb') as file:
+        for chunk in iter(lambda: file.read(1<<20), b''):
+            digest.update(chunk)
+
+
+@lru_cache(maxsize=None)
+def _pharmit_checksum():
+    digest = hashlib.sha256()
+    _file_digest(_PHARMIT, digest)
+    return digest.hexdigest()
+
+
+def _cache_key(ligand:str,extension:str,receptor:str=None,cmd:str='pharma'):
+    """Hash the PHARMIT binary, the command, the output format and the contents of the input files."""
+    digest = hashlib.sha256()
+    digest.update(_pharmit_checksum().encode())
+    digest.update(f"{cmd}\0{extension}\0{os.path.splitext(ligand)[1]}\0".encode())
+    _file_digest(ligand, digest)
+    if receptor is not None:
+        digest.update(f"\0receptor{os.path.splitext(receptor)[1]}\0".encode())
+        _file_digest(receptor, digest)
+    return digest.hexdigest()
+
+
+def _evict_cache(cache_dir:str,cache_size:int):
+    """Remove the least recently used entries until the cache folder fits in cache_size bytes."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.startswith('.'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= cache_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total = total - size
+
+
+def _cache_get(ligand:str,out_file:str=None,receptor:str=None,cmd:str='pharma',cache_dir:str=None):
+    """Look up a PHARMIT output in the cache folder.
+
+    Returns:
+        tuple: The path of the cache entry, whether it was found, and the cached output (the JSON bytes when out_file is None, otherwise None after copying the entry to out_file).
+    """
+    extension = '.json' if out_file is None else os.path.splitext(out_file)[1]
+    cached = os.path.join(cache_dir, _cache_key(ligand, extension, receptor, cmd)+extension)
+    try:
+        if out_file is None:
+            with open(cached, 'rb') as file:
+                output = file.read()
+        else:
+            shutil.copyfile(cached, out_file)
+            output = None
+        os.utime(cached)
+        return cached, True, output
+    except FileNotFoundError:
+        return cached, False, None
+
+
+def _cache_put(cached:str,out_file:str=None,output:bytes=None,cache_size:int=2**30):
+    """Store a successful PHARMIT output in the cache folder and evict old entries."""
+    cache_dir = os.path.dirname(cached)
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = os.path.join(cache_dir, f".{os.path.basename(cached)}.{os.getpid()}.{threading.get_ident()}")
+    if out_file is None and output:
+        with open(temporary, 'wb') as file:
+            file.write(output)
+    elif out_file is not None and os.path.exists(out_file):
+        shutil.copyfile(out_file, temporary)
+    else:
+        return
+    os.replace(temporary, cached)
+    _evict_cache(cache_dir, cache_size)
+
+
+def _pharma_args(ligand:str,out_file:str,receptor:str=None,cmd:str='pharma'):
+    args = ("-cmd", cmd)
+    if receptor is not None:
+        args = args + ("-receptor", receptor)
+    return args + ("-in", ligand, "-out", out_file)
+
+
+def _stdout_link(folder:str):
+    """Create a link named pharmacophore.json to the standard output inside folder.
+
+    PHARMIT picks the output format from the file extension, so the pipe is reached through a link with a .json name.
+    """
+    pipe = os.path.join(folder, 'pharmacophore.json')
+    os.symlink('/dev/stdout', pipe)
+    return pipe
+
+
+def _pharma(ligand:str,out_file:str=None,receptor:str=None,cmd:str='pharma',cache_dir:str=None,cache_size:int=2**30,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,capture_stderr:bool=False):
+    """Run a PHARMIT pharmacophore command for a ligand, with or without receptor.
+
+    When no output file is given, PHARMIT writes its JSON output to a pipe and the output is returned instead of being written to disk. When a cache folder is given, the output is looked up by a hash of the input files, the arguments and the PHARMIT binary before running PHARMIT, and stored there after a successful run.
+
+    Args:
+        ligand (str): The file name of the ligand structure in SDF or MOL2 format.
+        out_file (str, optional): The file name of the output file, including its extension. Defaults to None (JSON output through a pipe).
+        receptor (str, optional): The file name of the receptor structure in PDB format. Defaults to None.
+        cmd (str, optional): The command to run PHARMIT. Defaults to 'pharma'.
+        cache_dir (str, optional): The folder of the output cache. Defaults to None (no cache).
+        cache_size (int, optional): The maximum size of the cache folder in bytes. Defaults to 1 GiB.
+        timeout (float, optional): The wall-clock time limit of PHARMIT in seconds. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit of PHARMIT in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit of PHARMIT in seconds. Defaults to None (no limit).
+        capture_stderr (bool, optional): A boolean indicating whether to also return the standard error of PHARMIT. Defaults to False.
+
+    Returns:
+        tuple: The exit code of PHARMIT and its standard output, which holds the JSON output when out_file is None (None when the output file was copied from the cache), followed by its standard error with capture_stderr.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout.
+    """
+    if cache_dir is not None:
+        cached, hit, output = _cache_get(ligand, out_file, receptor, cmd, cache_dir)
+        if hit:
+            return (0, output, b'') if capture_stderr else (0, output)
+
+    if out_file is None:
+        with tempfile.TemporaryDirectory() as folder:
+            result = _run_pharmit(_pharma_args(ligand, _stdout_link(folder), receptor, cmd), timeout, memory_limit, cpu_limit, capture_stderr)
+    else:
+        result = _run_pharmit(_pharma_args(ligand, out_file, receptor, cmd), timeout, memory_limit, cpu_limit, capture_stderr)
+    returncode, output = result[:2]
+
+    if cache_dir is not None and returncode == 0 and (out_file is not None or output):
+        _cache_put(cached, out_file, output, cache_size)
+
+    return result
+
+
+async def _run_pharmit_async(args:tuple,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,capture_stderr:bool=False):
+    """Run the bundled PHARMIT executable without blocking the event loop.
+
+    If the awaiting task is cancelled or the timeout expires, the PHARMIT process is killed before the cancellation or the timeout is propagated.
+
+    Args:
+        args (tuple): The command line arguments passed to PHARMIT.
+        timeout (float, optional): The wall-clock time limit in seconds. Defaults to None (no limit).
+        memory_limit (int, optional): The address space limit (RLIMIT_AS) of the process in bytes. Defaults to None (no limit).
+        cpu_limit (int, optional): The CPU time limit (RLIMIT_CPU) of the process in seconds. Defaults to None (no limit).
+        capture_stderr (bool, optional): A boolean indicating whether to read the standard error of the process instead of letting it through. Defaults to False.
+
+    Returns:
+        tuple: The exit code of the process and the bytes written to its standard output, and to its standard error with capture_stderr.
+
+    Raises:
+        subprocess.TimeoutExpired: If PHARMIT ran longer than timeout.
+    """
+    started, start = time.time(), time.perf_counter()
+    process = await asyncio.create_subprocess_exec(str(_PHARMIT), *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE if capture_stderr else None)
+    _limit_resources(process.pid, memory_limit, cpu_limit)
+    try:
+        output, errors = await asyncio.wait_for(process.communicate(), timeout)
+    except (asyncio.CancelledError, asyncio.TimeoutError) as error:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        if isinstance(error, asyncio.TimeoutError):
+            _record_usage(args, started, time.perf_counter()-start, process.returncode, True)
+            raise subprocess.TimeoutExpired((str(_PHARMIT),)+tuple(args), timeout) from None
+        raise
+    _record_usage(args, started, time.perf_counter()-start, process.returncode, False)
+    if capture_stderr:
+        return process.returncode, output, errors
+    return process.returncode, output
+
+
+def _loop_semaphore():
+    """Return the semaphore shared by the asynchronous PHARMIT calls of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _SEMAPHORES:
+        _SEMAPHORES[loop] = asyncio.Semaphore(os.cpu_count() or 1)
+    return _SEMAPHORES[loop]
+
+
+async def _pharma_async(ligand:str,out_file:str=None,receptor:str=None,cmd:str='pharma',cache_dir:str=None,cache_size:int=2**30,timeout:float=None,memory_limit:int=None,cpu_limit:int=None,semaphore:asyncio.Semaphore=None,capture_stderr:bool=False):
+    """Asynchronous version of _pharma, limited by semaphore. Cache lookups and stores run in a worker thread."""
+    if semaphore is None:
+        semaphore = _loop_semaphore()
+
+    if cache_dir is not None:
+        cached, hit, output = await asyncio.to_thread(_cache_get, ligand, out_file, receptor, cmd, cache_dir)
+        if hit:
+            return (0, output, b'') if capture_stderr else (0, output)
+
+    async with semaphore:
+        if out_file is None:
+            with tempfile.TemporaryDirectory() as folder:
+                result = await _run_pharmit_async(_pharma_args(ligand, _stdout_link(folder), receptor, cmd), timeout, memory_limit, cpu_limit, capture_stderr)
+        else:
+            result = await _run_pharmit_async(_pharma_args(ligand, out_file, receptor, cmd), timeout, memory_limit, cpu_limit, capture_stderr)
+    returncode, output = result[:2]
+
+    if cache_dir is not None and returncode == 0 and (out_file is not None or output):
+        await asyncio.to_thread(_cache_put, cached, out_file, output, cache_size)
+
+    return result
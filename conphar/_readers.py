@@ -0,0 +1,263 @@
+__version__ = "0.1.0"
+__author__  = "https://github.com/AngelRuizMoreno"
+
+import os, json, mmap, re
+
+try:
+    # optional, several times faster than json on large PHARMIT documents
+    import orjson
+except ImportError:
+    orjson = None
+
+import pandas as pd
+import numpy as np
+
+# Colors of the pharmacophore features in the tables and the plots
+_COLOR_CODE = { 'Hydrophobic':        'green',\
+                 'HydrogenAcceptor':   'orange',\
+                 'HydrogenDonor':      'white',\
+                 'Aromatic':           'purple',\
+                 'NegativeIon':        'red',\
+                 'PositiveIon':        'navy',\
+                 'InclusionSphere':    'gray',\
+                 'Other':              'yellow',\
+                 'PhenylalanineAnalog':'pink',\
+                 'LeuValAnalog':       'pink' \
+                 }
+
+# Registry of the pharmacophore feature types: the integer code of a type is its position, so new types must be appended
+_FEATURE_TYPES = ('Aromatic', 'HydrogenAcceptor', 'HydrogenDonor', 'Hydrophobic', 'InclusionSphere', 'LeuValAnalog', 'NegativeIon', 'Other', 'PhenylalanineAnalog', 'PositiveIon')
+_FEATURE_DTYPE = pd.CategoricalDtype(_FEATURE_TYPES)
+_COLOR_DTYPE   = pd.CategoricalDtype(sorted(set(_COLOR_CODE.values())))
+# Color code (in _COLOR_DTYPE) of each feature type code
+_FEATURE_COLORS = np.array([_COLOR_DTYPE.categories.get_loc(_COLOR_CODE[name]) for name in _FEATURE_TYPES], dtype=np.int8)
+
+# Columns (and their types) of the points written by PHARMIT, given to the tables of pharmacophores without points
+_POINT_COLUMNS = {'enabled':bool, 'name':object, 'radius':float, 'size':np.int64, 'svector':object, 'vector':object, 'x':float, 'y':float, 'z':float}
+
+# Tokens that open, close or quote the nested values of a JSON document
+_JSON_TOKENS = re.compile(rb'[\[\]{}"]')
+_JSON_SCALAR_END = re.compile(rb'[,\]}\s]')
+_JSON_SPACE = re.compile(rb'\s*')
+
+
+def _json_loads(data:bytes):
+    """Decode a JSON value, with orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _json_value_end(buffer, index:int):
+    """Return the byte offset after the JSON value starting at index, skipping strings and nested values without decoding them."""
+    if buffer[index:index+1] == b'"':
+        while True:
+            index = buffer.find(b'"', index+1)
+            if index < 0:
+                raise ValueError("Unterminated JSON string")
+            escape = index-1
+            while buffer[escape] == 0x5c:
+                escape = escape-1
+            if (index-1-escape) % 2 == 0:
+                return index+1
+
+    if buffer[index:index+1] in (b'[', b'{'):
+        depth = 0
+        while True:
+            match = _JSON_TOKENS.search(buffer, index)
+            if match is None:
+                raise ValueError("Unterminated JSON value")
+            index = match.start()
+            if match.group() == b'"':
+                index = _json_value_end(buffer, index)
+                continue
+            depth = depth+1 if match.group() in (b'[', b'{') else depth-1
+            index = index+1
+            if depth == 0:
+                return index
+
+    match = _JSON_SCALAR_END.search(buffer, index)
+    return match.start() if match else len(buffer)
+
+
+def _scan_json_file(json_file:str, decode:tuple=('points',)):
+    """Read the top-level object of a JSON file through a memory map, decoding only the values of the keys in decode and returning the (start, end) byte offsets of the other values."""
+    with open(json_file, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(f"{json_file} is empty")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            index = _JSON_SPACE.match(buffer, 0).end()
+            if buffer[index:index+1] != b'{':
+                raise ValueError(f"{json_file} is not a JSON object")
+            data, offsets = {}, {}
+            index = _JSON_SPACE.match(buffer, index+1).end()
+            while buffer[index:index+1] != b'}':
+                key_end = _json_value_end(buffer, index)
+                key = json.loads(buffer[index:key_end])
+                index = _JSON_SPACE.match(buffer, key_end).end()
+                if buffer[index:index+1] != b':':
+                    raise ValueError(f"{json_file}: expected ':' at byte {index}")
+                start = _JSON_SPACE.match(buffer, index+1).end()
+                end = _json_value_end(buffer, start)
+                if key in decode or buffer[start:start+1] != b'"':
+                    data[key] = _json_loads(buffer[start:end])
+                else:
+                    offsets[key] = (start, end)
+                index = _JSON_SPACE.match(buffer, end).end()
+                if buffer[index:index+1] == b',':
+                    index = _JSON_SPACE.match(buffer, index+1).end()
+                elif buffer[index:index+1] != b'}':
+                    raise ValueError(f"{json_file}: expected ',' or '}}' at byte {index}")
+
+    return data, offsets
+
+
+def _parse_pharmacophore_data(data:dict):
+    """Build the pharmacophore table from a decoded PHARMIT JSON document, see parse_json_pharmacophore. A document without points ("points": null or []) gives an empty table with the usual columns."""
+
+    points=data.get('points')
+    table=pd.DataFrame(points) if points else pd.DataFrame({name:pd.Series(dtype=dtype) for name, dtype in _POINT_COLUMNS.items()})
+    
+    _encode_features(table)
+    _flatten_svectors(table)
+
+    lig=data.get('ligand')
+    receptor=data.get('receptor')
+
+    return table, lig, receptor
+
+
+def _encode_features(table:pd.DataFrame):
+    """Encode the 'name' column of a pharmacophore table as a Categorical of the feature type registry and add the matching 'color' Categorical, in place. Tables with feature names missing from the registry keep string columns."""
+    names = pd.Categorical(table['name'], dtype=_FEATURE_DTYPE)
+    if (names.codes < 0).any():
+        table['color'] = table['name'].map(_COLOR_CODE)
+        return table
+
+    table['name'] = names
+    table['color'] = pd.Categorical.from_codes(_FEATURE_COLORS[names.codes], dtype=_COLOR_DTYPE)
+    return table
+
+
+def _flatten_svectors(table:pd.DataFrame):
+    """Add the float columns 'sv_x', 'sv_y' and 'sv_z' (NaN without vector) and the boolean column 'has_vector' from the svector dicts of a pharmacophore table, in place."""
+    has_vector = table['svector'].notna().to_numpy() if 'svector' in table else np.zeros(len(table), dtype=bool)
+    components = np.full((len(table), 3), np.nan)
+    if has_vector.any():
+        components[has_vector] = pd.DataFrame.from_records(table['svector'].to_numpy()[has_vector], columns=['x','y','z']).to_numpy(dtype=float)
+
+    table['sv_x'], table['sv_y'], table['sv_z'] = components[:, 0], components[:, 1], components[:, 2]
+    table['has_vector'] = has_vector
+    return table
+
+
+def _split_json_documents(output:str):
+    """Decode the concatenated JSON documents that PHARMIT writes for a multi-molecule input, one per molecule."""
+    if isinstance(output, bytes):
+        output = output.decode()
+
+    decoder = json.JSONDecoder()
+    documents = []
+    index = 0
+    while True:
+        while index < len(output) and output[index].isspace():
+            index = index + 1
+        if index >= len(output):
+            return documents
+        document, index = decoder.raw_decode(output, index)
+        documents.append(document)
+
+
+def _iter_json_documents(file, chunk_size:int=2**20):
+    """Yield the concatenated JSON documents of an open text file one at a time, reading it in chunks so that only the current document is held in memory."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if eof:
+                return
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = chunk
+            continue
+        try:
+            document, index = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # the document is not complete yet
+            if eof:
+                raise
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer + chunk
+            continue
+        buffer = buffer[index:]
+        yield document
+
+
+def _load_json_chunk(json_files:list):
+    """Parse a chunk of PHARMIT JSON files into one pharmacophore table tagged with the ligand and file names, with the cache entries of the files (offsets of the embedded structures, columns, or the parse error)."""
+    points, ligands, files, entries = [], [], [], {}
+    for json_file in json_files:
+        try:
+            data, offsets = _scan_json_file(json_file, decode=('points',))
+            file_points = [point for point in data.get('points') or [] if 'name' in point]
+        except (OSError, ValueError, AttributeError, TypeError) as error:
+            entries[json_file] = {'error':str(error)}
+            continue
+        if not file_points:
+            entries[json_file] = {'error':'no pharmacophore points'}
+            continue
+        entries[json_file] = {'offsets':offsets, 'columns':list(dict.fromkeys(key for point in file_points for key in point))+['color','sv_x','sv_y','sv_z','has_vector']}
+        points.extend(file_points)
+        ligands.extend([os.path.splitext(os.path.basename(json_file))[0]]*len(file_points))
+        files.extend([json_file]*len(file_points))
+
+    table = pd.DataFrame(points)
+    if len(table):
+        _encode_features(table)
+        _flatten_svectors(table)
+        table['ligand'] = ligands
+        table['file'] = files
+
+    return table, entries
+
+
+def _file_signature(json_file:str):
+    """Return the modification time (ns) and the size of a file, which invalidate its entry in a point cache."""
+    stat = os.stat(json_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _iter_molecules(library:str):
+    """Read an SDF or MOL2 file lazily and yield the name and the text of each molecule."""
+    sdf = os.path.splitext(library)[1].lower() == '.sdf'
+    name, lines = None, []
+    expect_name = sdf
+
+    with open(library, 'r') as file:
+        for line in file:
+            if sdf:
+                if expect_name:
+                    name = line.strip()
+                    expect_name = False
+                lines.append(line)
+                if line.startswith('$$$$'):
+                    yield name, ''.join(lines)
+                    name, lines = None, []
+                    expect_name = True
+            else:
+                if line.startswith('@<TRIPOS>MOLECULE'):
+                    if name is not None:
+                        yield name, ''.join(lines)
+                        lines = []
+                    expect_name = True
+                elif expect_name:
+                    name = line.strip()
+                    expect_name = False
+                lines.append(line)
+
+    text = ''.join(lines)
+    if sdf and text.strip():
+        yield name, text.rstrip('\n')+'\n$$$$\n'
+    elif not sdf and name is not None:
+        yield name, text
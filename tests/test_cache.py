@@ -0,0 +1,92 @@
+"""Hits and misses of the PHARMIT output cache and of the Parquet point cache."""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+
+from conphar import get_molecule_pharmacophore, load_pharmacophore_directory, parse_json_pharmacophore, record_pharmit_usage
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example_files')
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'PHARMIT is only bundled for Linux')
+class OutputCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        with tempfile.TemporaryDirectory() as folder:
+            ligand = os.path.join(folder, 'ligand.sdf')
+            shutil.copy(os.path.join(EXAMPLES, 'ligand', '5R7Y_lig.sdf'), ligand)
+            cache_dir = os.path.join(folder, 'cache')
+
+            with record_pharmit_usage() as usage:
+                table = get_molecule_pharmacophore(ligand, cache_dir=cache_dir)[0]
+                self.assertEqual(len(usage), 1)
+
+                # the same input is read from the cache, for the piped and the file outputs, without starting PHARMIT
+                pd.testing.assert_frame_equal(get_molecule_pharmacophore(ligand, cache_dir=cache_dir)[0], table)
+                get_molecule_pharmacophore(ligand, os.path.join(folder, 'out'), cache_dir=cache_dir)
+                self.assertEqual(len(usage), 1)
+                pd.testing.assert_frame_equal(parse_json_pharmacophore(os.path.join(folder, 'out.json'))[0], table)
+
+                # the key is the contents of the file, not its name or modification time
+                with open(ligand) as file:
+                    title, text = file.read().split('\n', 1)
+                with open(ligand, 'w') as file:
+                    file.write(f'{title} changed\n{text}')
+                get_molecule_pharmacophore(ligand, cache_dir=cache_dir)
+                self.assertEqual(len(usage), 2)
+
+
+@unittest.skipIf(pyarrow is None, 'the point cache requires pyarrow')
+class PointCacheTest(unittest.TestCase):
+    def _load(self, folder, cache_file):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            table = load_pharmacophore_directory(folder, cache_file=cache_file, n_workers=1)
+        return table, output.getvalue().splitlines()[-1]
+
+    def test_hit_and_miss(self):
+        with tempfile.TemporaryDirectory() as folder:
+            pharmacophores = os.path.join(folder, 'pharmacophores')
+            shutil.copytree(os.path.join(EXAMPLES, 'pharmacophores'), pharmacophores)
+            cache_file = os.path.join(folder, 'points.parquet')
+
+            table, summary = self._load(pharmacophores, cache_file)
+            self.assertTrue(summary.endswith('(0 files from the cache)'), summary)
+
+            cached, summary = self._load(pharmacophores, cache_file)
+            self.assertTrue(summary.endswith('(10 files from the cache)'), summary)
+            pd.testing.assert_frame_equal(cached[['name', 'x', 'y', 'z', 'radius', 'ligand']], table[['name', 'x', 'y', 'z', 'radius', 'ligand']])
+
+            # a changed file is parsed again, and a removed one leaves the cache
+            json_file = os.path.join(pharmacophores, '5R7Y.json')
+            with open(json_file) as file:
+                text = file.read()
+            with open(json_file, 'w') as file:
+                file.write(text.replace('"HydrogenAcceptor"', '"HydrogenDonor"', 1))
+            os.remove(os.path.join(pharmacophores, '5R80.json'))
+
+            cached, summary = self._load(pharmacophores, cache_file)
+            self.assertTrue(summary.endswith('(8 files from the cache)'), summary)
+            self.assertNotIn('5R80', set(cached['ligand']))
+            expected = parse_json_pharmacophore(json_file)[0]
+            self.assertEqual(list(cached[cached['ligand'] == '5R7Y']['name'].astype(str)), list(expected['name'].astype(str)))
+
+            # parse_json_pharmacophore reads the same points from the cache
+            table, lig, receptor = parse_json_pharmacophore(json_file, cache_file=cache_file)
+            self.assertEqual(list(table['name'].astype(str)), list(expected['name'].astype(str)))
+            self.assertEqual(lig, parse_json_pharmacophore(json_file)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
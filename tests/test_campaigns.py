@@ -0,0 +1,84 @@
+"""Behaviour of the batch and library runners on molecules without pharmacophore features."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+from conphar import get_library_pharmacophores, parse_json_pharmacophore, run_pharmacophore_batch
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example_files')
+
+# A molecule without features, PHARMIT writes {"points": null} for it
+HELIUM = """He
+  conphar
+
+  1  0  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 He  0  0  0  0  0  0  0  0  0  0  0  0
+M  END
+$$$$
+"""
+
+
+def _library(folder, *records):
+    library = os.path.join(folder, 'library.sdf')
+    with open(library, 'w') as file:
+        for record in records:
+            file.write(record)
+    return library
+
+
+def _ligand(name):
+    with open(os.path.join(EXAMPLES, 'ligand', f'{name}_lig.sdf')) as file:
+        return file.read()
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'PHARMIT is only bundled for Linux')
+class LibraryTest(unittest.TestCase):
+    def test_featureless_molecule(self):
+        with tempfile.TemporaryDirectory() as folder:
+            library = _library(folder, HELIUM, _ligand('5R7Y'))
+            out = os.path.join(folder, 'library')
+
+            results = sorted(get_library_pharmacophores(library, out=out, verbose=False), key=lambda result: result['molecule'])
+            self.assertEqual([result['molecule'] for result in results], [0, 1])
+            self.assertEqual([result['status'] for result in results], ['done', 'done'])
+            self.assertEqual(len(results[0]['table']), 0)
+
+            table = parse_json_pharmacophore(f'{out}.json')[0]
+            self.assertEqual(len(table), len(results[1]['table']))
+            self.assertEqual(set(table['molecule']), {1})
+
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'PHARMIT is only bundled for Linux')
+class BatchTest(unittest.TestCase):
+    def _run(self, group_by_receptor):
+        receptor = os.path.join(EXAMPLES, 'receptor', '5R7Y_A.pdb')
+        with tempfile.TemporaryDirectory() as folder:
+            helium = _library(folder, HELIUM)
+            ligand = os.path.join(EXAMPLES, 'ligand', '5R7Y_lig.sdf')
+            empty = os.path.join(folder, 'empty.sdf')
+            open(empty, 'w').close()
+            jobs = [(receptor, helium, os.path.join(folder, 'helium')), (receptor, ligand, os.path.join(folder, 'ligand')), (receptor, empty, os.path.join(folder, 'empty')),
+                    (receptor, helium, None), (receptor, empty, None)]
+            results = run_pharmacophore_batch(jobs, group_by_receptor=group_by_receptor, verbose=False)
+            return {(os.path.basename(result['ligand']), result['out'] is None):result for result in results}
+
+    def _check(self, results):
+        self.assertEqual({key:result['status'] for key, result in results.items()},
+                         {('library.sdf', False):'done', ('5R7Y_lig.sdf', False):'done', ('empty.sdf', False):'failed', ('library.sdf', True):'done', ('empty.sdf', True):'failed'})
+        self.assertEqual(len(results['library.sdf', False]['table']), 0)
+        self.assertEqual(len(results['library.sdf', True]['table']), 0)
+        self.assertIn('has_vector', results['library.sdf', True]['table'])
+        self.assertGreater(len(results['5R7Y_lig.sdf', False]['table']), 0)
+
+    def test_featureless_and_empty_ligands(self):
+        self._check(self._run(group_by_receptor=False))
+
+    def test_featureless_and_empty_ligands_grouped(self):
+        self._check(self._run(group_by_receptor=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
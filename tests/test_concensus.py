@@ -0,0 +1,70 @@
+"""Clustering modes of compute_concensus_pharmacophore on the example pharmacophores."""
+
+import os
+import unittest
+
+import numpy as np
+
+from conphar import compute_concensus_pharmacophore, load_pharmacophore_directory
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example_files')
+
+
+def _centers(concensus):
+    return concensus.sort_values(['name', 'x', 'y', 'z'])[['x', 'y', 'z', 'weight']].to_numpy(float)
+
+
+class ConcensusTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # 5R8T.json and 5RE5.json are empty and skipped
+        cls.table = load_pharmacophore_directory(os.path.join(EXAMPLES, 'pharmacophores'), verbose=False)
+        cls.counts = cls.table['name'].astype(str).value_counts().to_dict()
+
+    def _concensus(self, **kwargs):
+        concensus, links = compute_concensus_pharmacophore(self.table, save_data_per_descriptor=False, **kwargs)
+        # every point is counted once in the weights, and the balances of a descriptor add up to one
+        self.assertEqual(concensus.groupby('name')['weight'].sum().to_dict(), self.counts)
+        np.testing.assert_allclose(concensus.groupby('name')['balance'].sum().to_numpy(), 1)
+        return concensus, links
+
+    def test_xyz(self):
+        concensus, links = self._concensus(cluster_space='xyz')
+        self.assertEqual(len(concensus), 13)
+        for name, link in links.items():
+            n = len(link['table'])
+            self.assertEqual(link['matrix'].shape, (n*(n-1)//2,), name)
+            self.assertEqual(link['linkage'].shape, (n-1, 4), name)
+
+    def test_graph(self):
+        # with the example points, the clusters of the graph at 1.5 A are those of the 3D linkage
+        concensus, links = self._concensus(cluster_space='graph')
+        np.testing.assert_allclose(_centers(concensus), _centers(self._concensus(cluster_space='xyz')[0]))
+        for name, link in links.items():
+            self.assertIsNone(link['linkage'], name)
+            self.assertEqual(link['matrix'].shape, (len(link['table']),)*2, name)
+
+        # all the points of a descriptor are linked beyond the size of the pocket
+        concensus, _ = self._concensus(cluster_space='graph', graph_cutoff=100)
+        self.assertEqual(concensus.set_index('name')['weight'].to_dict(), self.counts)
+
+    def test_voxels(self):
+        xyz, _ = self._concensus(cluster_space='xyz')
+
+        # voxels smaller than the distance between two points hold one point each, and change nothing
+        concensus, links = self._concensus(cluster_space='xyz', voxel_size=1e-3)
+        np.testing.assert_allclose(_centers(concensus), _centers(xyz))
+        self.assertEqual(sum(len(link['table']) for link in links.values()), len(self.table))
+
+        # larger voxels cluster fewer representatives, which stand for all the points
+        concensus, links = self._concensus(cluster_space='graph', voxel_size=2.0)
+        self.assertLess(sum(len(link['table']) for link in links.values()), len(self.table))
+        self.assertEqual(sum(link['table']['members'].sum() for link in links.values()), len(self.table))
+        self.assertLessEqual(len(concensus), len(xyz))
+
+        with self.assertRaises(ValueError):
+            compute_concensus_pharmacophore(self.table, save_data_per_descriptor=False, voxel_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Validation of the NumPy perception engine against PHARMIT on the example ligands and receptor."""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from conphar import get_molecule_pharmacophore
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example_files')
+LIGAND_FOLDER = os.path.join(EXAMPLES, 'ligand')
+RECEPTOR = os.path.join(EXAMPLES, 'receptor', '5R80_A.pdb')
+
+# 5R82 carries a 2-aminopyridine ring that OpenBabel, and so PHARMIT, does not perceive as aromatic:
+# PHARMIT reports {HydrogenAcceptor: 2, HydrogenDonor: 1, Hydrophobic: 1}, while the NumPy engine also
+# places the Aromatic and the ring Hydrophobic points. test_5r82 records this as an expected failure.
+MISMATCHED = ('5R82_lig.sdf',)
+
+# Largest distance (A) between a PHARMIT point and the NumPy point of the same feature
+TOLERANCE = 0.01
+# Largest angle (degrees) between a PHARMIT vector and the matching NumPy vector
+ANGLE_TOLERANCE = 5.0
+
+
+def _ligands():
+    return [file for file in sorted(os.listdir(LIGAND_FOLDER))
+            if file.endswith('.sdf') and os.path.getsize(os.path.join(LIGAND_FOLDER, file)) > 0]
+
+
+def _counts(pharmacophore):
+    return pharmacophore.name.astype(str).value_counts().to_dict()
+
+
+def _vectors(point):
+    return np.array([[vector['x'], vector['y'], vector['z']] for vector in point['vector']]).reshape(-1, 3)
+
+
+def _backbone(pdb_file):
+    """Coordinates of the backbone N and O atoms of a PDB file, without the N-terminal residue, whose hydrogen directions are fixed by the peptide plane."""
+    coordinates, first = [], None
+    with open(pdb_file) as file:
+        for line in file:
+            if line.startswith('ATOM') and line[12:16].strip() in ('N', 'O'):
+                residue = line[17:27]
+                first = residue if first is None else first
+                if residue != first:
+                    coordinates.append([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+    return np.array(coordinates)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'PHARMIT is only bundled for Linux')
+class NumpyEngineTest(unittest.TestCase):
+    def _pharmacophores(self, path):
+        try:
+            expected = get_molecule_pharmacophore(path)[0]
+        except (OSError, RuntimeError) as error:
+            self.skipTest(f'PHARMIT could not run: {error}')
+        return expected, get_molecule_pharmacophore(path, engine='numpy')[0]
+
+    def _compare(self, expected, result, vectors_at=None):
+        """Check the feature counts and positions, and the vectors of the points at the coordinates vectors_at (all of them by default)."""
+        self.assertEqual(_counts(result), _counts(expected))
+
+        cosine = np.cos(np.radians(ANGLE_TOLERANCE))
+        for name in _counts(expected):
+            reference = expected[expected.name == name].reset_index(drop=True)
+            points = result[result.name == name].reset_index(drop=True)
+            distances, nearest = cKDTree(points[['x', 'y', 'z']].to_numpy(float)).query(reference[['x', 'y', 'z']].to_numpy(float))
+            self.assertLess(np.max(distances), TOLERANCE, name)
+
+            checked = np.ones(len(reference), dtype=bool)
+            if vectors_at is not None and name != 'Aromatic':
+                checked = cKDTree(vectors_at).query(reference[['x', 'y', 'z']].to_numpy(float))[0] < TOLERANCE
+            for k in np.flatnonzero(checked):
+                point = points.iloc[nearest[k]]
+                self.assertEqual(point['has_vector'], reference.at[k, 'has_vector'], name)
+                if not point['has_vector']:
+                    continue
+                # the svector is the mean of the vectors, and the ring normal of an aromatic point has no sign
+                svectors = [table[['sv_x', 'sv_y', 'sv_z']].to_numpy(float) for table in (point, reference.loc[k])]
+                svector = np.dot(*svectors)/np.linalg.norm(svectors[0])/np.linalg.norm(svectors[1])
+                self.assertGreater(abs(svector) if name == 'Aromatic' else svector, cosine, name)
+                # every PHARMIT vector has a NumPy vector in the same direction
+                vectors, reference_vectors = _vectors(point), _vectors(reference.iloc[k])
+                self.assertEqual(len(vectors), len(reference_vectors), name)
+                self.assertTrue(((reference_vectors @ vectors.T).max(axis=1) > cosine).all(), name)
+
+    def test_ligands(self):
+        for file in _ligands():
+            if file in MISMATCHED:
+                continue
+            with self.subTest(ligand=file):
+                self._compare(*self._pharmacophores(os.path.join(LIGAND_FOLDER, file)))
+
+    @unittest.expectedFailure
+    def test_5r82(self):
+        self._compare(*self._pharmacophores(os.path.join(LIGAND_FOLDER, '5R82_lig.sdf')))
+
+    def test_receptor_pdb(self):
+        # the receptor has no CONECT records, so the bonds come from the distances; the hydrogens of its hydroxyls, thiols
+        # and charged groups can rotate, so only the vectors of the backbone and of the aromatic rings are compared
+        self._compare(*self._pharmacophores(RECEPTOR), vectors_at=_backbone(RECEPTOR))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+"""Reading of the PHARMIT text query files."""
+
+import os
+import tempfile
+import unittest
+
+from conphar import iter_pharmacophore_queries
+
+# PHARMIT output for a two-molecule input: the points of both molecules follow each other without a separator
+TEXT = """Aromatic 12.1388 -0.370333 23.1162 [ -0.34197 0.60259 -0.72107 ] [ 0.34197 -0.60259 0.72107 ]
+HydrogenDonor 8.562 -3.5 24.567 [ -0.580744 0.805349 0.118954 ]
+Hydrophobic 9.948 -5.5 26.143
+HydrogenAcceptor 10.541 1.4161 24.36 [ -0.832822 -0.132996 0.537326 ]
+Hydrophobic 9.1852 6.1013 22.6414
+"""
+
+
+class TextQueryTest(unittest.TestCase):
+    def test_one_pharmacophore_per_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_name = os.path.join(folder, 'query.txt')
+            with open(file_name, 'w') as file:
+                file.write(TEXT)
+
+            queries = list(iter_pharmacophore_queries(file_name))
+
+        self.assertEqual([name for name, table in queries], ['0'])
+        table = queries[0][1]
+        self.assertEqual(list(table['name'].astype(str)), ['Aromatic', 'HydrogenDonor', 'Hydrophobic', 'HydrogenAcceptor', 'Hydrophobic'])
+        self.assertEqual(table['has_vector'].tolist(), [True, True, False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Recovery of PharmacophoreStore appends interrupted part way."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from conphar import PharmacophoreStore, load_pharmacophore_directory
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example_files')
+
+
+class StoreTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        table = load_pharmacophore_directory(os.path.join(EXAMPLES, 'pharmacophores'), verbose=False)
+        cls.first, cls.second = table[table['ligand'] < '5R81'], table[table['ligand'] >= '5R81']
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.store = PharmacophoreStore(self.folder.name)
+        self.store.append(self.first)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.folder.name, name)
+
+    def _check(self, store):
+        # the store holds both tables in order, every row is indexed once under its feature type
+        points = store[:]
+        self.assertEqual(len(store), len(self.first)+len(self.second))
+        np.testing.assert_allclose(points.xyz, np.concatenate([table[['x', 'y', 'z']].to_numpy(float) for table in (self.first, self.second)]), atol=1e-4)
+        self.assertEqual(store.ligands, sorted(set(self.first['ligand']) | set(self.second['ligand'])))
+        self.assertEqual([store.ligands[i] for i in points.ligand_ids], list(self.first['ligand'])+list(self.second['ligand']))
+        rows = np.sort(np.concatenate([store.rows(name) for name in store.counts()]))
+        np.testing.assert_array_equal(rows, np.arange(len(store)))
+        for name in store.counts():
+            self.assertTrue((points.names[store.rows(name)] == name).all(), name)
+
+    def test_append(self):
+        self.store.append(self.second)
+        self._check(self.store)
+        self._check(PharmacophoreStore(self.folder.name))
+
+    def test_torn_writes(self):
+        # an append killed in the middle of writing a ligand name, a record and a row number
+        with open(self._path('ligands.txt'), 'a') as file:
+            file.write('5R8')
+        with open(self._path('points.bin'), 'ab') as file:
+            file.write(b'\0'*(PharmacophoreStore.record_dtype.itemsize//2))
+        with open(self._path('type_01.idx'), 'ab') as file:
+            file.write(b'\0'*4)
+
+        store = PharmacophoreStore(self.folder.name)
+        store.append(self.second)
+        self._check(store)
+
+    def test_unindexed_records(self):
+        # an append killed after its records were synced and the row numbers of some feature types were written
+        rows = self.store.append(self.second)
+        name = max(self.store.counts(), key=self.store.counts().get)
+        indexed = np.array(self.store.rows(name))
+        with open(self._path(f'type_{PharmacophoreStore.feature_types.index(name):02d}.idx'), 'wb') as file:
+            file.write(indexed[indexed < rows[0]].tobytes())
+
+        store = PharmacophoreStore(self.folder.name)
+        store.append(self.second.iloc[:0])
+        self._check(store)
+
+
+if __name__ == '__main__':
+    unittest.main()